@@ -1,31 +1,256 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from abc import ABC, abstractmethod
 import os
+import asyncio
 import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import uuid
 from datetime import datetime, timedelta
 import hashlib
+import hmac
+import json
+import bcrypt
+import base64
+import binascii
+import bisect
+import heapq
+import re
+import unicodedata
 import jwt
 from bson import ObjectId
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Deployment: WEB_CONCURRENCY worker processes per node (uvicorn --workers reads the same
+# variable) split the node's connection and thread budgets between them
+WEB_CONCURRENCY = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+CPU_COUNT = os.cpu_count() or 1
+
+# MongoDB connection, sized per worker
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))  # per node
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))  # per worker
+# Timeouts in milliseconds; unset ones keep the driver defaults (no wait-queue or socket timeout)
+MONGO_TIMEOUTS_MS = {
+    option: int(os.environ[name]) for option, name in [
+        ("connectTimeoutMS", "MONGO_CONNECT_TIMEOUT_MS"),
+        ("serverSelectionTimeoutMS", "MONGO_SERVER_SELECTION_TIMEOUT_MS"),
+        ("socketTimeoutMS", "MONGO_SOCKET_TIMEOUT_MS"),
+        ("waitQueueTimeoutMS", "MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        ("maxIdleTimeMS", "MONGO_MAX_IDLE_TIME_MS"),
+    ] if os.environ.get(name)
+}
+# Wire compression, e.g. "zstd,zlib"; zstd and snappy need their Python packages installed
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+
+# Read-heavy endpoints (feed, search, comments) read from secondaries when there are any.
+# Mongo requires a staleness bound of at least 90s; -1 disables it
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'secondaryPreferred')
+MONGO_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '90'))
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+class PoolWaitMetrics(monitoring.ConnectionPoolListener):
+    """Tracks how long operations wait to check a connection out of each pool.
+
+    The driver reports the start and end of a checkout from the thread doing
+    it, so a thread-local timestamp pairs the two events.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pools: Dict[str, dict] = {}
+
+    def _pool(self, address) -> dict:
+        key = f"{address[0]}:{address[1]}"
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = {
+                "open_connections": 0,
+                "checkouts": 0,
+                "failed_checkouts": 0,
+                "total_wait_ms": 0.0,
+                "max_wait_ms": 0.0
+            }
+        return pool
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = (time.perf_counter() - getattr(self._local, "started", time.perf_counter())) * 1000
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["checkouts"] += 1
+            pool["total_wait_ms"] += waited
+            pool["max_wait_ms"] = max(pool["max_wait_ms"], waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._pool(event.address)["failed_checkouts"] += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pool(event.address)["open_connections"] += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._pool(event.address)["open_connections"] -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {address: {
+                **pool,
+                "avg_wait_ms": pool["total_wait_ms"] / pool["checkouts"] if pool["checkouts"] else 0.0
+            } for address, pool in self._pools.items()}
+
+pool_metrics = PoolWaitMetrics()
+
+def mongo_read_preference():
+    mode = READ_PREFERENCES[MONGO_READ_PREFERENCE]
+    return mode() if mode is Primary else mode(max_staleness=MONGO_MAX_STALENESS_SECONDS)
+
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=max(1, MONGO_MAX_POOL_SIZE // WEB_CONCURRENCY),
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    event_listeners=[pool_metrics],
+    **MONGO_TIMEOUTS_MS,
+    **({"compressors": MONGO_COMPRESSORS} if MONGO_COMPRESSORS else {})
+)
 db = client[os.environ['DB_NAME']]
+# Same database, for reads that tolerate replication lag; writes and
+# read-your-own-write lookups (likes, watched state) stay on `db`
+read_db = client.get_database(os.environ['DB_NAME'], read_preference=mongo_read_preference())
+
+# Startup maintenance runs in one worker under a Mongo lease lock; workers that
+# start within STARTUP_DONE_TTL_SECONDS of it finishing skip it
+STARTUP_LOCK_LEASE_SECONDS = float(os.environ.get('STARTUP_LOCK_LEASE_SECONDS', '30'))
+STARTUP_DONE_TTL_SECONDS = float(os.environ.get('STARTUP_DONE_TTL_SECONDS', '60'))
+
+# Entries per namespace in the per-worker response caches
+SHARED_STATE_MAX_SIZE = int(os.environ.get('SHARED_STATE_MAX_SIZE', '10000'))
 
 # JWT Configuration
 SECRET_KEY = os.environ.get('SECRET_KEY', 'vyzo-secret-key-change-in-production')
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+# Access tokens are short-lived; clients renew them with a refresh token
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', '15'))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', '30'))
+# Decoded claims are cached per token until it expires
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', '100000'))
+
+# Password hashing: bcrypt cost factor and the size of the thread pool it runs in
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(max(1, CPU_COUNT // WEB_CONCURRENCY))))
+
+# Feed ranking: engagement_score = likes_count*2 + comments_count*3 + views,
+# stored on each video and kept current with $inc on every engagement write
+ENGAGEMENT_WEIGHTS = {"likes_count": 2, "comments_count": 3, "views": 1}
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+# Ranked batches scanned per feed request; a user who has watched most of the
+# catalog gets a short page and a cursor rather than a scan of everything
+FEED_MAX_SCAN_BATCHES = int(os.environ.get('FEED_MAX_SCAN_BATCHES', '5'))
+COMMENTS_PAGE_SIZE = 50
+COMMENTS_MAX_PAGE_SIZE = 100
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 100
+CONVERSATIONS_PAGE_SIZE = 20
+CONVERSATIONS_MAX_PAGE_SIZE = 100
+SEARCH_RESULT_LIMIT = 20
+SEARCH_BRANCH_TIMEOUT_SECONDS = float(os.environ.get('SEARCH_BRANCH_TIMEOUT_SECONDS', '2'))
+SUGGESTION_LIMIT = 10
+
+# View events are buffered in-process and written in batches
+VIEW_FLUSH_INTERVAL_SECONDS = float(os.environ.get('VIEW_FLUSH_INTERVAL_SECONDS', '1.0'))
+VIEW_FLUSH_MAX_EVENTS = int(os.environ.get('VIEW_FLUSH_MAX_EVENTS', '500'))
+
+# Trending searches decay exponentially; counts are flushed to hot_searches periodically
+TRENDING_HALF_LIFE_SECONDS = float(os.environ.get('TRENDING_HALF_LIFE_SECONDS', str(2 * 3600)))
+TRENDING_MAX_KEYWORDS = int(os.environ.get('TRENDING_MAX_KEYWORDS', '10000'))
+TRENDING_FLUSH_INTERVAL_SECONDS = float(os.environ.get('TRENDING_FLUSH_INTERVAL_SECONDS', '10'))
+HOT_SEARCH_LIMIT = 10
+
+# Username/avatar changes are copied onto comments, messages and notifications in the background
+PROFILE_RECONCILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_RECONCILE_INTERVAL_SECONDS', '5'))
+
+# Authenticated user documents are cached between requests
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+UNREAD_COUNT_CACHE_TTL_SECONDS = float(os.environ.get('UNREAD_COUNT_CACHE_TTL_SECONDS', '30'))
+
+# Shared (non-personal) read results are cached briefly per endpoint
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '5'))
+
+# Comment and message images live in a content-addressed blob store, not in documents
+MEDIA_DIR = Path(os.environ.get('MEDIA_DIR', str(ROOT_DIR / 'media')))
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', str(10 * 1024 * 1024)))
+MEDIA_CHUNK_SIZE = 64 * 1024
+MEDIA_BACKFILL_BATCH_SIZE = 100
+
+# Writes to cached collections reach every worker's caches through a change feed:
+# "stream" (change streams, needs a replica set), "poll" (diffs full snapshots; meant
+# for the in-memory test stand-in), "auto" (stream when available, otherwise off;
+# polls the stand-in) or "off"
+CHANGE_FEED_MODE = os.environ.get('CHANGE_FEED_MODE', 'auto')
+WS_AUTH_CHECK_INTERVAL_SECONDS = float(os.environ.get('WS_AUTH_CHECK_INTERVAL_SECONDS', '30'))
+CHANGE_FEED_POLL_INTERVAL_SECONDS = float(os.environ.get('CHANGE_FEED_POLL_INTERVAL_SECONDS', '1.0'))
+CHANGE_FEED_BATCH_SECONDS = float(os.environ.get('CHANGE_FEED_BATCH_SECONDS', '0.5'))
+CHANGE_FEED_BATCH_SIZE = int(os.environ.get('CHANGE_FEED_BATCH_SIZE', '500'))
+
+# Real-time events queued per WebSocket connection before new ones are dropped
+PUBSUB_QUEUE_SIZE = int(os.environ.get('PUBSUB_QUEUE_SIZE', '100'))
+# "memory" reaches sockets on this worker only; "mongo" also relays events to the
+# other workers through the change feed
+PUBSUB_BACKEND = os.environ.get('PUBSUB_BACKEND', 'mongo' if WEB_CONCURRENCY > 1 else 'memory')
+PUBSUB_EVENT_TTL_SECONDS = float(os.environ.get('PUBSUB_EVENT_TTL_SECONDS', '60'))
+
+# Notifications are written by background workers in batches
+NOTIFICATION_QUEUE_SIZE = int(os.environ.get('NOTIFICATION_QUEUE_SIZE', '10000'))
+NOTIFICATION_WORKERS = int(os.environ.get('NOTIFICATION_WORKERS', '2'))
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', '100'))
+NOTIFICATION_BATCH_WINDOW_SECONDS = float(os.environ.get('NOTIFICATION_BATCH_WINDOW_SECONDS', '0.2'))
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -35,33 +260,1588 @@ api_router = APIRouter(prefix="/api")
 
 # Security
 security = HTTPBearer()
+# For endpoints that also accept credentials in the body
+optional_security = HTTPBearer(auto_error=False)
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+user_cache = TTLCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+token_cache = TTLCache(TOKEN_CACHE_MAX_SIZE, REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+
+class TokenRevocationList:
+    """Revoked tokens and per-user cutoffs, checked in memory on every request.
+
+    Individual tokens (logout) are kept by `jti` only until they would have
+    expired anyway. Revoking a user (logout everywhere, ban) records a cutoff
+    and rejects every token issued before it; tokens issued before `jti`
+    existed can only be revoked that way. Both are mirrored to Mongo so a
+    restart does not resurrect revoked tokens.
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, float] = {}  # jti -> exp
+        self._users: Dict[str, float] = {}  # user_id -> tokens issued before this are revoked
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self._tokens:
+            return True
+        cutoff = self._users.get(claims["user_id"])
+        return cutoff is not None and claims.get("iat", 0) < cutoff
+
+    def _prune(self):
+        now = time.time()
+        for jti in [jti for jti, exp in self._tokens.items() if exp <= now]:
+            del self._tokens[jti]
+
+    def apply_token(self, jti: str, exp: float):
+        self._prune()
+        self._tokens[jti] = exp
+
+    def apply_user(self, user_id: str, cutoff: float):
+        self._users[user_id] = max(cutoff, self._users.get(user_id, 0))
+
+    async def revoke(self, claims: dict):
+        jti = claims.get("jti")
+        if jti is None:
+            await self.revoke_user(claims["user_id"])
+            return
+        self.apply_token(jti, claims["exp"])
+        await db.revoked_tokens.update_one(
+            {"_id": jti},
+            {"$set": {"expires_at": datetime.utcfromtimestamp(claims["exp"])}},
+            upsert=True
+        )
+
+    async def consume(self, claims: dict) -> bool:
+        """Retire a single-use token atomically in Mongo; False if it was already used or revoked.
+
+        The in-memory list may lag behind other workers when the change feed is
+        off, so this checks and writes the shared collections directly.
+        """
+        jti = claims.get("jti")
+        if jti is None:
+            return False
+        revoked_user = await db.revoked_users.find_one({"_id": claims["user_id"]})
+        if revoked_user is not None:
+            self.apply_user(claims["user_id"], revoked_user["revoked_before"])
+            if claims.get("iat", 0) < revoked_user["revoked_before"]:
+                return False
+        self.apply_token(jti, claims["exp"])
+        try:
+            await db.revoked_tokens.insert_one(
+                {"_id": jti, "expires_at": datetime.utcfromtimestamp(claims["exp"])}
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def revoke_user(self, user_id: str):
+        cutoff = time.time()
+        self.apply_user(user_id, cutoff)
+        await db.revoked_users.update_one({"_id": user_id}, {"$set": {"revoked_before": cutoff}}, upsert=True)
+
+    async def load(self):
+        now = datetime.utcnow()
+        async for doc in db.revoked_tokens.find({"expires_at": {"$gt": now}}):
+            self.apply_token(doc["_id"], (doc["expires_at"] - datetime(1970, 1, 1)).total_seconds())
+        async for doc in db.revoked_users.find({}):
+            self.apply_user(doc["_id"], doc["revoked_before"])
+
+    def stats(self) -> dict:
+        return {"tokens": len(self._tokens), "users": len(self._users)}
+
+token_revocations = TokenRevocationList()
+
+class SharedStateBackend(ABC):
+    """Interface for cached values shared by the request handlers of a worker.
+
+    Values are grouped into namespaces and keyed by strings. Each worker
+    keeps its own copy; the change feed invalidates namespaces in every
+    worker when the collections behind them change, so a cache hit stays
+    cheaper than the query it replaces.
+    """
+
+    @abstractmethod
+    async def get(self, namespace: str, key: str):
+        ...
+
+    @abstractmethod
+    async def set(self, namespace: str, key: str, value, ttl: float):
+        ...
+
+    @abstractmethod
+    async def delete(self, namespace: str, keys: Optional[List[str]] = None):
+        """Drop `keys`, or the whole namespace when `keys` is None."""
+
+class InMemorySharedState(SharedStateBackend):
+    """Process-local backend with a bounded TTL cache per namespace."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._caches: Dict[str, TTLCache] = {}
+
+    def _cache(self, namespace: str) -> TTLCache:
+        cache = self._caches.get(namespace)
+        if cache is None:
+            cache = self._caches[namespace] = TTLCache(self.max_size, 0)
+        return cache
+
+    async def get(self, namespace: str, key: str):
+        return self._cache(namespace).get(key)
+
+    async def set(self, namespace: str, key: str, value, ttl: float):
+        self._cache(namespace).set(key, value, ttl=ttl)
+
+    async def delete(self, namespace: str, keys: Optional[List[str]] = None):
+        if keys is None:
+            self._cache(namespace).clear()
+        for key in keys or []:
+            self._cache(namespace).invalidate(key)
+
+shared_state: SharedStateBackend = InMemorySharedState(SHARED_STATE_MAX_SIZE)
+
+class SharedCache:
+    """Read-through cache over the shared state backend with per-namespace hit stats.
+
+    Change feed handlers call `invalidate(namespace)` when the underlying
+    data changes; the TTL bounds staleness for anything they do not cover.
+    """
+
+    def __init__(self, backend: SharedStateBackend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+
+    async def get(self, namespace: str, key: str):
+        value = await self.backend.get(namespace, key)
+        counter = self._misses if value is None else self._hits
+        counter[namespace] = counter.get(namespace, 0) + 1
+        return value
+
+    async def set(self, namespace: str, key: str, value):
+        await self.backend.set(namespace, key, value, self.ttl)
+        return value
+
+    async def invalidate(self, namespace: str, keys: Optional[List[str]] = None):
+        await self.backend.delete(namespace, keys)
+
+    def stats(self) -> dict:
+        stats = {}
+        for namespace in set(self._hits) | set(self._misses):
+            hits, misses = self._hits.get(namespace, 0), self._misses.get(namespace, 0)
+            stats[namespace] = {"hits": hits, "misses": misses, "hit_ratio": hits / (hits + misses)}
+        return stats
+
+response_cache = SharedCache(shared_state, RESPONSE_CACHE_TTL_SECONDS)
+unread_count_cache = SharedCache(shared_state, UNREAD_COUNT_CACHE_TTL_SECONDS)
+
+def make_etag(body) -> str:
+    digest = hashlib.sha1(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest}"'
+
+def etag_response(request: Request, response: Response, etag: str, body):
+    """Return `body` tagged with `etag`, or an empty 304 if the client already has it."""
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = f"max-age={int(RESPONSE_CACHE_TTL_SECONDS)}"
+    return body
+
+class BackgroundFlusher(ABC):
+    """Runs `flush()` every `interval` seconds, and once more on `stop()`."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    async def flush(self):
+        ...
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception(f"{type(self).__name__} flush failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+class ViewEventBuffer(BackgroundFlusher):
+    """Write-behind buffer for video views.
+
+    `record_view` only appends to memory; view counts are coalesced per video
+    and flushed with one `bulk_write`, watch history rows with one
+    `insert_many`, either every `interval` seconds or once `max_events`
+    views are pending. `stop()` performs a final flush on shutdown.
+    """
+
+    def __init__(self, interval: float, max_events: int):
+        super().__init__(interval)
+        self.max_events = max_events
+        self.history_rows: List[dict] = []
+        self.view_counts: Dict[str, int] = {}
+        self.watched: Dict[Tuple[str, str], dict] = {}
+        self._lock = asyncio.Lock()
+        self._pending_flush: Optional[asyncio.Task] = None
+
+    def record(self, user_id: str, video_id: str, watch_duration: float):
+        now = datetime.utcnow()
+        self.history_rows.append({
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "video_id": video_id,
+            "watch_duration": watch_duration,
+            "created_at": now
+        })
+        self.view_counts[video_id] = self.view_counts.get(video_id, 0) + 1
+        entry = self.watched.setdefault((user_id, video_id), {"watch_count": 0})
+        entry["watch_count"] += 1
+        entry["last_watched_at"] = now
+        
+        if len(self.history_rows) >= self.max_events and (
+            self._pending_flush is None or self._pending_flush.done()
+        ):
+            self._pending_flush = asyncio.create_task(self.flush())
+
+    def pending_watched(self, user_id: str, video_ids: List[str]) -> set:
+        return {video_id for video_id in video_ids if (user_id, video_id) in self.watched}
+
+    def _requeue(self, history_rows: List[dict], view_counts: Dict[str, int], watched: Dict[Tuple[str, str], dict]):
+        """Merges an unflushed batch back into the buffers for the next flush."""
+        self.history_rows[:0] = history_rows
+        for video_id, count in view_counts.items():
+            self.view_counts[video_id] = self.view_counts.get(video_id, 0) + count
+        for key, entry in watched.items():
+            current = self.watched.get(key)
+            if current is None:
+                self.watched[key] = entry
+            else:
+                current["watch_count"] += entry["watch_count"]
+                current["last_watched_at"] = max(current["last_watched_at"], entry["last_watched_at"])
+
+    async def flush(self):
+        async with self._lock:
+            if not (self.history_rows or self.view_counts or self.watched):
+                return
+            history_rows, self.history_rows = self.history_rows, []
+            view_counts, self.view_counts = self.view_counts, {}
+            watched, self.watched = self.watched, {}
+            
+            # Each step is requeued only until it has succeeded, so a retry
+            # never counts the same views twice
+            try:
+                if history_rows:
+                    try:
+                        await db.watch_history.insert_many(history_rows, ordered=False)
+                    except BulkWriteError as e:
+                        # Rows carry their own _id; duplicates were written by an earlier attempt
+                        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                            raise
+                    history_rows = []
+                if watched:
+                    await db.watched_videos.bulk_write([
+                        UpdateOne(
+                            {"user_id": user_id, "video_id": video_id},
+                            {"$inc": {"watch_count": entry["watch_count"]},
+                             "$max": {"last_watched_at": entry["last_watched_at"]}},
+                            upsert=True
+                        ) for (user_id, video_id), entry in watched.items()
+                    ], ordered=False)
+                    watched = {}
+                if view_counts:
+                    await db.videos.bulk_write([
+                        UpdateOne(
+                            {"_id": ObjectId(video_id)},
+                            {"$inc": {"views": count, "engagement_score": count * ENGAGEMENT_WEIGHTS["views"]}}
+                        ) for video_id, count in view_counts.items()
+                    ], ordered=False)
+            except Exception:
+                logger.exception(f"Failed to flush view events; keeping {len(history_rows)} rows for the next flush")
+                self._requeue(history_rows, view_counts, watched)
+
+view_buffer = ViewEventBuffer(VIEW_FLUSH_INTERVAL_SECONDS, VIEW_FLUSH_MAX_EVENTS)
+
+class TrendingSearches(BackgroundFlusher):
+    """Exponentially decayed search counters held in memory.
+
+    Each search adds 2^((t - base) / half_life) to its keyword's score
+    (forward decay), so scores can be compared without touching every
+    keyword as time passes; dividing by the current weight gives the
+    decayed count "as of now". Scores are rescaled when the weights grow
+    large, and only the top `max_keywords` are kept. Raw search counts are
+    accumulated and flushed to `hot_searches` every `interval` seconds
+    together with the decayed score. `hot_searches` holds the score shared by
+    all workers; the change feed copies it back with `apply`.
+    """
+
+    def __init__(self, half_life: float, max_keywords: int, interval: float):
+        super().__init__(interval)
+        self.half_life = half_life
+        self.max_keywords = max_keywords
+        self._base = time.time()
+        self._scores: Dict[str, float] = {}
+        self._pending: Dict[str, int] = {}
+
+    def _weight(self, at: float) -> float:
+        return 2 ** ((at - self._base) / self.half_life)
+
+    def _rescale(self, now: float):
+        if now - self._base < 32 * self.half_life:
+            return
+        factor = self._weight(now)
+        self._scores = {keyword: score / factor for keyword, score in self._scores.items()}
+        self._base = now
+
+    def _prune(self):
+        if len(self._scores) > 2 * self.max_keywords:
+            self._scores = dict(heapq.nlargest(self.max_keywords, self._scores.items(), key=lambda item: item[1]))
+
+    def add(self, keyword: str, count: float, at: float):
+        now = time.time()
+        self._rescale(now)
+        decayed = count * 2 ** (-(now - at) / self.half_life)
+        self._scores[keyword] = self._scores.get(keyword, 0.0) + decayed * self._weight(now)
+        self._prune()
+
+    def record(self, keyword: str):
+        self.add(keyword, 1, time.time())
+        self._pending[keyword] = self._pending.get(keyword, 0) + 1
+
+    def current(self, keyword: str) -> float:
+        return self._scores.get(keyword, 0.0) / self._weight(time.time())
+
+    def unflushed(self, keyword: str) -> int:
+        return self._pending.get(keyword, 0)
+
+    def apply(self, keyword: str, score: float, at: float):
+        """Replace a keyword's score with the shared one, keeping searches not yet flushed from here."""
+        self._scores.pop(keyword, None)
+        self.add(keyword, score, at)
+        if keyword in self._pending:
+            self.add(keyword, self._pending[keyword], time.time())
+
+    def top(self, limit: int) -> List[Tuple[str, float]]:
+        weight = self._weight(time.time())
+        return [(keyword, score / weight)
+                for keyword, score in heapq.nlargest(limit, self._scores.items(), key=lambda item: item[1])]
+
+    def apply_document(self, hot: dict):
+        # Older documents only have the lifetime count; decay it from its last update
+        now = datetime.utcnow()
+        score = hot.get("trend_score", hot.get("count", 0))
+        at = hot.get("trend_at", hot.get("updated_at", now))
+        self.apply(hot["keyword"], score, time.time() - (now - at).total_seconds())
+
+    async def load(self):
+        self._scores.clear()
+        async for hot in db.hot_searches.find({}):
+            self.apply_document(hot)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        now = datetime.utcnow()
+        # Decay the stored score to now and add this worker's searches in one atomic
+        # update, so concurrent flushes from several workers all count
+        half_life_ms = self.half_life * 1000
+        try:
+            await db.hot_searches.bulk_write([
+                UpdateOne({"keyword": keyword}, [{"$set": {
+                    "count": {"$add": [{"$ifNull": ["$count", 0]}, count]},
+                    "updated_at": now,
+                    "trend_score": {"$add": [{"$multiply": [
+                        {"$ifNull": ["$trend_score", 0]},
+                        {"$pow": [0.5, {"$divide": [
+                            {"$subtract": [now, {"$ifNull": ["$trend_at", now]}]}, half_life_ms
+                        ]}]}
+                    ]}, count]},
+                    "trend_at": now
+                }}], upsert=True) for keyword, count in pending.items()
+            ], ordered=False)
+        except Exception:
+            for keyword, count in pending.items():
+                self._pending[keyword] = self._pending.get(keyword, 0) + count
+            raise
+
+trending_searches = TrendingSearches(TRENDING_HALF_LIFE_SECONDS, TRENDING_MAX_KEYWORDS, TRENDING_FLUSH_INTERVAL_SECONDS)
+
+class ProfileReconciler(BackgroundFlusher):
+    """Propagates profile changes to the author snapshots on other documents.
+
+    Comments, messages and notifications store the author's username and
+    avatar when they are written, and conversations both participants'
+    usernames, so listing them needs no users lookup.
+    When a user renames themselves the snapshots are rewritten here, a few
+    seconds later, instead of on the request path. The user document carries
+    a `profile_sync_pending` flag until its snapshots are rewritten, so
+    renames queued by a worker that dies are picked up again by `load()` at
+    startup.
+    """
+
+    # collection -> (author id field, {profile field: snapshot field})
+    SNAPSHOTS = {
+        "comments": ("user_id", {"username": "username", "avatar": "avatar"}),
+        "messages": ("sender_id", {"username": "sender_username", "avatar": "sender_avatar"}),
+        "notifications": ("from_user_id", {"username": "from_username"}),
+    }
+
+    def __init__(self, interval: float):
+        super().__init__(interval)
+        self._pending: Dict[str, dict] = {}
+
+    def record(self, user_id: str, profile: dict):
+        self._pending.setdefault(user_id, {}).update(profile)
+
+    async def load(self):
+        async for user in db.users.find({"profile_sync_pending": True}, {"username": 1, "avatar": 1}):
+            self.record(str(user["_id"]), {"username": user["username"], "avatar": user.get("avatar")})
+        if self._pending:
+            logger.info(f"Resuming profile sync for {len(self._pending)} users")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        
+        failed = 0
+        for user_id, profile in pending.items():
+            try:
+                for collection, (author_field, fields) in self.SNAPSHOTS.items():
+                    snapshot = {fields[k]: v for k, v in profile.items() if k in fields}
+                    if snapshot:
+                        await db[collection].update_many({author_field: user_id}, {"$set": snapshot})
+                if "username" in profile:
+                    await db.conversations.update_many(
+                        {"participants": user_id}, {"$set": {f"usernames.{user_id}": profile["username"]}}
+                    )
+                # Clear the flag only if the profile has not changed again meanwhile
+                await db.users.update_one(
+                    {"_id": ObjectId(user_id), "profile_sync_pending": True, **profile},
+                    {"$unset": {"profile_sync_pending": ""}}
+                )
+            except Exception:
+                # Retry on the next flush unless a newer change has been queued
+                self._pending[user_id] = {**profile, **self._pending.get(user_id, {})}
+                failed += 1
+        if failed:
+            raise RuntimeError(f"Profile sync failed for {failed} users, will retry")
+
+profile_reconciler = ProfileReconciler(PROFILE_RECONCILE_INTERVAL_SECONDS)
+
+class PubSubBackend(ABC):
+    """Interface for carrying real-time events from publishers to subscribers.
+
+    Channels are named per user (`user:<id>`). The in-memory backend below
+    only reaches connections held by this process; the Mongo backend also
+    relays events to the other workers.
+    """
+
+    # Whether published events reach subscribers in other processes
+    cross_process = False
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        ...
+
+    @abstractmethod
+    def unsubscribe(self, channel: str, queue: asyncio.Queue):
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, event: dict):
+        ...
+
+    def stats(self) -> dict:
+        return {}
+
+class InMemoryPubSubBackend(PubSubBackend):
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.published = 0
+        self.dropped = 0
+        self._subscribers: Dict[str, set] = {}
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(channel)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[channel]
+
+    async def publish(self, channel: str, event: dict):
+        self.published += 1
+        for queue in self._subscribers.get(channel, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A slow client must not hold up the publisher
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped
+        }
+
+class MongoPubSubBackend(InMemoryPubSubBackend):
+    """Delivers to local subscribers at once and relays through `realtime_events`.
+
+    Each event is also inserted into a TTL collection tagged with the
+    publishing worker; the change feed hands the inserts to every worker,
+    which delivers the ones published elsewhere. Relayed events are as
+    timely as the change feed, and are not relayed when it is off.
+    """
+
+    cross_process = True
+
+    def __init__(self, queue_size: int, ttl: float):
+        super().__init__(queue_size)
+        self.ttl = ttl
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self.relayed = 0
+
+    async def publish(self, channel: str, event: dict):
+        await super().publish(channel, event)
+        await db.realtime_events.insert_one({
+            "channel": channel,
+            "event": event,
+            "origin": self.origin,
+            "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)
+        })
+
+    async def apply_changes(self, changes: List[dict]):
+        for change in changes:
+            doc = change.get("fullDocument")
+            if change["operationType"] != "insert" or doc is None or doc["origin"] == self.origin:
+                continue
+            self.relayed += 1
+            await super().publish(doc["channel"], doc["event"])
+
+    def stats(self) -> dict:
+        return {**super().stats(), "relayed": self.relayed}
+
+pubsub: PubSubBackend = (
+    MongoPubSubBackend(PUBSUB_QUEUE_SIZE, PUBSUB_EVENT_TTL_SECONDS) if PUBSUB_BACKEND == "mongo"
+    else InMemoryPubSubBackend(PUBSUB_QUEUE_SIZE)
+)
+
+async def publish_to_user(user_id: str, event_type: str, data: BaseModel):
+    await pubsub.publish(f"user:{user_id}", {"type": event_type, "data": data.model_dump(mode="json")})
+
+class NotificationPipeline:
+    """Background fan-out of notifications, decoupled from request handlers.
+
+    Handlers `submit()` an event and return immediately. Events are sharded by
+    recipient (or video) over one bounded queue per worker, so events that
+    can be coalesced land on the same worker. Workers drain their queue in
+    batches (up to `batch_size` events, waiting at most
+    `window` seconds for more), resolve video owners with one query, coalesce
+    likes on the same video into a single "N people liked" notification,
+    which is also merged into the recipient's unread like notification for
+    that video if there is one, store the rest of the batch with
+    `insert_many` and publish each notification to its recipient. When the
+    queue is full new events are dropped and counted.
+    """
+
+    def __init__(self, queue_size: int, workers: int, batch_size: int, window: float):
+        self.queue_size = queue_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.window = window
+        self.submitted = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.written = 0
+        self.batches = 0
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_queues(self):
+        if not self._queues:
+            self._queues = [asyncio.Queue(maxsize=max(1, self.queue_size // self.workers)) for _ in range(self.workers)]
+
+    def submit(self, event: dict) -> bool:
+        self._ensure_queues()
+        shard = hash(event.get("user_id") or event.get("video_id")) % self.workers
+        try:
+            self._queues[shard].put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Notification queue full, dropping {event['type']} event")
+            return False
+        self.submitted += 1
+        return True
+
+    async def _next_batch(self, queue: asyncio.Queue) -> List[dict]:
+        batch = [await queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.window
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _resolve_recipients(self, events: List[dict]):
+        # Events about a video are addressed to its owner, looked up per batch
+        video_ids = {e["video_id"] for e in events if e.get("user_id") is None and ObjectId.is_valid(e.get("video_id") or "")}
+        owners = {}
+        if video_ids:
+            videos = await db.videos.find(
+                {"_id": {"$in": [ObjectId(v) for v in video_ids]}}, {"author_id": 1}
+            ).to_list(len(video_ids))
+            owners = {str(v["_id"]): v.get("author_id") for v in videos}
+        for event in events:
+            if event.get("user_id") is None:
+                event["user_id"] = owners.get(event.get("video_id"))
+
+    def _coalesce(self, events: List[dict]) -> List[dict]:
+        notifications = []
+        likes: Dict[Tuple[str, str], dict] = {}
+        for event in events:
+            # Nobody can read a notification without a recipient
+            if not event["user_id"] or event["user_id"] == event["from_user_id"]:
+                continue
+            event["count"] = 1
+            if event["type"] == "like":
+                key = (event["user_id"], event["video_id"])
+                if key in likes:
+                    likes[key]["count"] += 1
+                    self.coalesced += 1
+                    continue
+                likes[key] = event
+            notifications.append(event)
+        
+        now = datetime.utcnow()
+        for notification in notifications:
+            notification.update({"_id": ObjectId(), "read": False, "created_at": now})
+        return notifications
+
+    async def _merge_like(self, notification: dict) -> Tuple[dict, bool]:
+        """Folds a like into the unread like notification for the same video.
+
+        Returns the stored notification and whether it was newly created.
+        """
+        merged = await db.notifications.find_one_and_update(
+            {"user_id": notification["user_id"], "type": "like",
+             "video_id": notification["video_id"], "read": False},
+            {
+                "$inc": {"count": notification["count"]},
+                "$set": {
+                    "from_user_id": notification["from_user_id"],
+                    "from_username": notification["from_username"],
+                    "created_at": notification["created_at"]
+                },
+                "$setOnInsert": {"_id": notification["_id"], "content": notification["content"]}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if merged["_id"] != notification["_id"]:
+            self.coalesced += 1
+            return merged, False
+        return merged, True
+
+    async def _process(self, events: List[dict]):
+        await self._resolve_recipients(events)
+        notifications = self._coalesce(events)
+        created = [notification for notification in notifications if notification["type"] != "like"]
+        delivered = list(created)
+        if created:
+            await db.notifications.insert_many(created, ordered=False)
+        for notification in notifications:
+            if notification["type"] == "like":
+                merged, inserted = await self._merge_like(notification)
+                delivered.append(merged)
+                if inserted:
+                    created.append(merged)
+        # Only new documents add to the unread badge; merged likes are already counted
+        if created:
+            await adjust_unread_counts([notification["user_id"] for notification in created], 1)
+        for notification in delivered:
+            await publish_to_user(notification["user_id"], "notification", notification_response(notification))
+        self.written += len(created)
+        self.batches += 1
+
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            batch = await self._next_batch(queue)
+            try:
+                await self._process(batch)
+            except Exception:
+                logger.exception(f"Failed to deliver {len(batch)} notification events")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    def start(self):
+        self._ensure_queues()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run(queue)) for queue in self._queues]
+
+    async def stop(self):
+        # Deliver whatever is already queued before shutting the workers down
+        if self._tasks:
+            await asyncio.gather(*[queue.join() for queue in self._queues])
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(queue.qsize() for queue in self._queues),
+            "capacity": self.queue_size,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "written": self.written,
+            "batches": self.batches
+        }
+
+notification_pipeline = NotificationPipeline(
+    NOTIFICATION_QUEUE_SIZE, NOTIFICATION_WORKERS, NOTIFICATION_BATCH_SIZE, NOTIFICATION_BATCH_WINDOW_SECONDS
+)
+
+class SearchIndex:
+    """In-process inverted index with substring and prefix matching.
+
+    Each document's searchable fields are normalised (NFKC, casefolded) and
+    indexed two ways: character bigrams and trigrams for substring queries
+    of two or more characters, and a sorted token list for one-character
+    prefix queries.
+    Candidates are verified against the text and ranked by how well each
+    weighted field matches (whole field > whole token > token prefix >
+    substring), newest document first on ties. Documents are added or
+    replaced incrementally with `add()`.
+    """
+
+    def __init__(self, fields: Dict[str, int]):
+        self.fields = fields
+        self._docs: Dict[str, Dict[str, str]] = {}
+        self._grams: Dict[str, set] = {}
+        self._tokens: Dict[str, set] = {}
+        self._sorted_tokens: List[str] = []
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return unicodedata.normalize("NFKC", text or "").casefold().strip()
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return [token for token in re.split(r"\W+", text) if token]
+
+    @staticmethod
+    def ngrams(text: str, n: int) -> set:
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def _keys(self, doc: Dict[str, str]):
+        grams, tokens = set(), set()
+        for text in doc.values():
+            grams |= self.ngrams(text, 2) | self.ngrams(text, 3)
+            tokens.update(self.tokenize(text))
+        return grams, tokens
+
+    def add(self, doc_id: str, values: Dict[str, str]):
+        self.remove(doc_id)
+        doc = {field: self.normalize(values.get(field)) for field in self.fields}
+        self._docs[doc_id] = doc
+        grams, tokens = self._keys(doc)
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(doc_id)
+        for token in tokens:
+            if token not in self._tokens:
+                self._tokens[token] = set()
+                bisect.insort(self._sorted_tokens, token)
+            self._tokens[token].add(doc_id)
+
+    def get(self, doc_id: str) -> Optional[Dict[str, str]]:
+        """The normalized fields indexed for a document."""
+        return self._docs.get(doc_id)
+
+    def remove(self, doc_id: str):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        grams, tokens = self._keys(doc)
+        for gram in grams:
+            self._grams[gram].discard(doc_id)
+            if not self._grams[gram]:
+                del self._grams[gram]
+        for token in tokens:
+            self._tokens[token].discard(doc_id)
+            if not self._tokens[token]:
+                del self._tokens[token]
+                self._sorted_tokens.pop(bisect.bisect_left(self._sorted_tokens, token))
+
+    def clear(self):
+        self._docs.clear()
+        self._grams.clear()
+        self._tokens.clear()
+        self._sorted_tokens.clear()
+
+    def _candidates(self, query: str) -> set:
+        if len(query) == 2:
+            return set(self._grams.get(query, ()))
+        if len(query) >= 3:
+            postings = sorted((self._grams.get(gram, set()) for gram in self.ngrams(query, 3)), key=len)
+            return set.intersection(*postings)
+        candidates = set()
+        start = bisect.bisect_left(self._sorted_tokens, query)
+        for token in self._sorted_tokens[start:]:
+            if not token.startswith(query):
+                break
+            candidates |= self._tokens[token]
+        return candidates
+
+    def _score(self, doc: Dict[str, str], query: str) -> int:
+        score = 0
+        for field, weight in self.fields.items():
+            text = doc[field]
+            if text == query:
+                score += 8 * weight
+            elif query in text:
+                tokens = self.tokenize(text)
+                if query in tokens:
+                    score += 4 * weight
+                elif any(token.startswith(query) for token in tokens):
+                    score += 2 * weight
+                else:
+                    score += weight
+        return score
+
+    def search(self, text: str, limit: int) -> List[str]:
+        query = self.normalize(text)
+        if not query:
+            return []
+        ranked = []
+        for doc_id in self._candidates(query):
+            score = self._score(self._docs[doc_id], query)
+            if score:
+                ranked.append((score, doc_id))
+        # ObjectId strings sort by creation time, so ties favour newer documents
+        ranked.sort(reverse=True)
+        return [doc_id for _, doc_id in ranked[:limit]]
+
+    def __len__(self):
+        return len(self._docs)
+
+video_search_index = SearchIndex({"title": 2, "author": 1})
+user_search_index = SearchIndex({"username": 2})
+
+class TrieNode:
+    __slots__ = ("children", "terms", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "TrieNode"] = {}
+        self.terms: set = set()
+        self.top: List[str] = []
+
+class SuggestionTrie:
+    """Prefix trie for search-as-you-type suggestions.
+
+    Every node caches the best `k` terms beneath it, ranked by weight (the
+    hot search count), then by length, so a lookup only walks the prefix.
+    Raising a term's weight merges it into the caches along its path;
+    lowering or removing it rebuilds those caches bottom-up from the
+    children. Paths stop at `max_depth` characters to bound memory on long
+    titles. Titles and usernames stay until removed; terms that are only
+    searched keywords are capped at the top `max_keywords` by weight.
+    """
+
+    def __init__(self, k: int, max_keywords: int = 10000, max_depth: int = 32):
+        self.k = k
+        self.max_keywords = max_keywords
+        self.max_depth = max_depth
+        self._weights: Dict[str, Tuple[int, str]] = {}
+        self._names: set = set()
+        self._keywords: set = set()
+        self._root = TrieNode()
+
+    def _rank(self, key: str):
+        return (-self._weights[key][0], len(key), key)
+
+    def _path(self, key: str) -> List[TrieNode]:
+        path = [self._root]
+        for char in key[:self.max_depth]:
+            node = path[-1].children.get(char)
+            if node is None:
+                node = path[-1].children[char] = TrieNode()
+            path.append(node)
+        return path
+
+    def _rebuild(self, path: List[TrieNode]):
+        for node in reversed(path):
+            candidates = set(node.terms)
+            for child in node.children.values():
+                candidates.update(child.top)
+            node.top = sorted(candidates, key=self._rank)[:self.k]
+
+    def _drop(self, key: str):
+        del self._weights[key]
+        self._names.discard(key)
+        self._keywords.discard(key)
+        path = self._path(key)
+        path[-1].terms.discard(key)
+        # Unlink nodes left with no terms beneath them
+        while len(path) > 1 and not path[-1].terms and not path[-1].children:
+            path.pop()
+            del path[-1].children[key[len(path) - 1]]
+        self._rebuild(path)
+
+    def _prune(self):
+        if len(self._keywords) > 2 * self.max_keywords:
+            keep = set(heapq.nlargest(self.max_keywords, self._keywords, key=lambda key: self._weights[key][0]))
+            for key in self._keywords - keep:
+                self._drop(key)
+
+    def add(self, text: str):
+        """Add a title or username, with no search count unless it is already known."""
+        key = SearchIndex.normalize(text)
+        if not key:
+            return
+        self._names.add(key)
+        self._keywords.discard(key)
+        if key not in self._weights:
+            self.set_weight(text, 0)
+
+    def remove(self, text: str):
+        """Remove a title or username; if it has been searched for it stays as a keyword."""
+        key = SearchIndex.normalize(text)
+        if key not in self._names:
+            return
+        self._names.discard(key)
+        if self._weights[key][0] > 0:
+            self._keywords.add(key)
+            self._prune()
+        else:
+            self._drop(key)
+
+    def increment(self, text: str):
+        key = SearchIndex.normalize(text)
+        self.set_weight(text, self._weights[key][0] + 1 if key in self._weights else 1)
+
+    def set_weight(self, text: str, weight: int):
+        key = SearchIndex.normalize(text)
+        if not key:
+            return
+        previous = self._weights.get(key)
+        if previous is not None and previous[0] == weight:
+            return
+        self._weights[key] = (weight, previous[1] if previous else text.strip())
+        path = self._path(key)
+        path[-1].terms.add(key)
+        if key not in self._names:
+            self._keywords.add(key)
+        
+        if previous is None or weight > previous[0]:
+            rank = self._rank(key)
+            # Ancestors rank a superset of terms, so once the term misses a
+            # node's top k it cannot make any ancestor's either
+            for node in reversed(path):
+                top = node.top
+                if key in top:
+                    top.remove(key)
+                elif len(top) >= self.k and rank >= self._rank(top[-1]):
+                    break
+                ranks = [self._rank(t) for t in top]
+                top.insert(bisect.bisect_left(ranks, rank), key)
+                del top[self.k:]
+        else:
+            self._rebuild(path)
+        self._prune()
+
+    def suggest(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        key = SearchIndex.normalize(prefix)
+        node = self._root
+        for char in key[:self.max_depth]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        keys = [k for k in node.top if k.startswith(key)]
+        return [(self._weights[k][1], self._weights[k][0]) for k in keys[:limit]]
+
+    def clear(self):
+        self._weights.clear()
+        self._names.clear()
+        self._keywords.clear()
+        self._root = TrieNode()
+
+    def __len__(self):
+        return len(self._weights)
+
+suggestion_trie = SuggestionTrie(SUGGESTION_LIMIT, TRENDING_MAX_KEYWORDS)
+
+async def build_search_indexes():
+    video_search_index.clear()
+    user_search_index.clear()
+    suggestion_trie.clear()
+    async for hot in db.hot_searches.find({}, {"keyword": 1, "count": 1}):
+        suggestion_trie.set_weight(hot["keyword"], hot["count"])
+    async for video in db.videos.find({}, {"title": 1, "author": 1}):
+        video_search_index.add(str(video["_id"]), video)
+        suggestion_trie.add(video["title"])
+    async for user in db.users.find({}, {"username": 1}):
+        user_search_index.add(str(user["_id"]), user)
+        suggestion_trie.add(user["username"])
+    logger.info(
+        f"Search index built: {len(video_search_index)} videos, {len(user_search_index)} users, "
+        f"{len(suggestion_trie)} suggestions"
+    )
+
+class ChangeFeedConsumer:
+    """Applies writes on watched collections to in-process caches and derived state.
+
+    Handlers register per collection with `on` and receive batches of change
+    events, so a write handler only has to write to Mongo: every worker sees
+    the change here, whichever worker (or node) made it. Events come from a
+    change stream with full documents. Polling mode diffs full snapshots of
+    the watched collections into events of the same shape; it is meant for
+    the in-memory stand-in and small deployments, since every poll scans
+    the watched collections.
+    """
+
+    def __init__(self, mode: str, poll_interval: float, batch_seconds: float, batch_size: int):
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.batch_seconds = batch_seconds
+        self.batch_size = batch_size
+        self.source: Optional[str] = None
+        self.events = 0
+        self.batches = 0
+        self._handlers: Dict[str, list] = {}
+        self._snapshots: Dict[str, Dict[Any, dict]] = {}
+        self._resume_token = None
+        self._task: Optional[asyncio.Task] = None
+
+    def on(self, collection: str):
+        """Register the decorated coroutine for batches of changes on `collection`."""
+        def register(handler):
+            self._handlers.setdefault(collection, []).append(handler)
+            return handler
+        return register
+
+    async def _dispatch(self, changes: List[dict]):
+        by_collection: Dict[str, List[dict]] = {}
+        for change in changes:
+            by_collection.setdefault(change["ns"]["coll"], []).append(change)
+        for collection, batch in by_collection.items():
+            for handler in self._handlers.get(collection, []):
+                try:
+                    await handler(batch)
+                except Exception:
+                    logger.exception(f"Change handler {handler.__name__} failed on {len(batch)} events")
+        self.events += len(changes)
+        self.batches += 1
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self._handlers)}}}]
+        async with db.watch(pipeline, full_document="updateLookup", resume_after=self._resume_token) as stream:
+            batch: List[dict] = []
+            deadline = 0.0
+            while True:
+                change = await stream.try_next()
+                if change is not None:
+                    if not batch:
+                        deadline = time.monotonic() + self.batch_seconds
+                    batch.append(change)
+                if batch and (change is None or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                    await self._dispatch(batch)
+                    batch = []
+                # Saved after dispatching so a restart replays anything not yet applied
+                self._resume_token = stream.resume_token
+
+    async def _snapshot(self, collection: str) -> Dict[Any, dict]:
+        return {doc["_id"]: doc async for doc in db[collection].find({})}
+
+    async def _poll(self):
+        changes = []
+        for collection in self._handlers:
+            current = await self._snapshot(collection)
+            previous = self._snapshots.get(collection)
+            self._snapshots[collection] = current
+            if previous is None:
+                continue
+            for doc_id, doc in current.items():
+                old = previous.get(doc_id)
+                if old is None:
+                    changes.append({"operationType": "insert", "ns": {"coll": collection},
+                                    "documentKey": {"_id": doc_id}, "fullDocument": doc})
+                elif old != doc:
+                    updated = {k: v for k, v in doc.items() if old.get(k) != v}
+                    changes.append({"operationType": "update", "ns": {"coll": collection},
+                                    "documentKey": {"_id": doc_id}, "fullDocument": doc,
+                                    "updateDescription": {"updatedFields": updated}})
+            for doc_id in previous.keys() - current.keys():
+                changes.append({"operationType": "delete", "ns": {"coll": collection},
+                                "documentKey": {"_id": doc_id}})
+        if changes:
+            await self._dispatch(changes)
+
+    async def open(self):
+        """Fix the point the feed starts from, before the caches it maintains are built.
+
+        Opens the change stream to take a resume token, or takes the baseline
+        snapshots to poll against, so every write made while the caches load
+        is replayed once `start()` runs.
+        """
+        mode = self.mode
+        if mode == "auto":
+            # The in-memory stand-in has no watch() and is small enough to poll
+            mode = "stream" if hasattr(type(db), "watch") else "poll"
+        if mode == "stream":
+            pipeline = [{"$match": {"ns.coll": {"$in": list(self._handlers)}}}]
+            try:
+                async with db.watch(pipeline, full_document="updateLookup") as stream:
+                    # Changes returned here predate the caches, which will include them
+                    await stream.try_next()
+                    self._resume_token = stream.resume_token
+            except OperationFailure as e:
+                if self.mode == "auto":
+                    # A standalone mongod rejects change streams; full-scan polling
+                    # would cost more than the caches save, so the feed stays off
+                    logger.warning(
+                        f"Change streams unavailable ({e}); change feed disabled, so caches and real-time "
+                        "events only see this worker's writes. Run Mongo as a replica set, or set "
+                        "CHANGE_FEED_MODE=poll"
+                    )
+                    mode = "off"
+                else:
+                    logger.exception("Could not open the change stream; the feed will keep retrying")
+        elif mode == "poll":
+            for collection in self._handlers:
+                self._snapshots[collection] = await self._snapshot(collection)
+        self.source = mode
+
+    async def _run(self):
+        while True:
+            try:
+                if self.source == "stream":
+                    await self._watch()
+                else:
+                    await self._poll()
+                    await asyncio.sleep(self.poll_interval)
+            except OperationFailure as e:
+                if e.code == 286:  # ChangeStreamHistoryLost: the resume point aged out of the oplog
+                    self._resume_token = None
+                logger.exception("Change feed failed; retrying")
+                await asyncio.sleep(self.poll_interval)
+            except Exception:
+                logger.exception("Change feed failed; retrying")
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Apply changes from the point fixed by `open()`."""
+        if self.source in ("stream", "poll") and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"source": self.source, "events": self.events, "batches": self.batches}
+
+change_feed = ChangeFeedConsumer(
+    CHANGE_FEED_MODE, CHANGE_FEED_POLL_INTERVAL_SECONDS, CHANGE_FEED_BATCH_SECONDS, CHANGE_FEED_BATCH_SIZE
+)
+
+if isinstance(pubsub, MongoPubSubBackend):
+    change_feed.on("realtime_events")(pubsub.apply_changes)
+
+@change_feed.on("users")
+async def apply_user_changes(changes: List[dict]):
+    for change in changes:
+        user_id = str(change["documentKey"]["_id"])
+        user_cache.invalidate(user_id)
+        user = change.get("fullDocument")
+        previous = user_search_index.get(user_id)
+        # A rename (or deletion) retires the old username from suggestions
+        if previous and (user is None or previous["username"] != SearchIndex.normalize(user["username"])):
+            suggestion_trie.remove(previous["username"])
+        if user is None:
+            user_search_index.remove(user_id)
+        else:
+            user_search_index.add(user_id, user)
+            suggestion_trie.add(user["username"])
+
+@change_feed.on("videos")
+async def apply_video_changes(changes: List[dict]):
+    for change in changes:
+        video_id = str(change["documentKey"]["_id"])
+        video = change.get("fullDocument")
+        updated = change.get("updateDescription", {}).get("updatedFields", {})
+        if video is None:
+            video_search_index.remove(video_id)
+        # Counter updates ($inc on likes/views) leave the searchable text alone
+        elif change["operationType"] != "update" or "title" in updated or "author" in updated:
+            video_search_index.add(video_id, video)
+            suggestion_trie.add(video["title"])
+    # Any write can reorder the feed; one invalidation covers the whole batch
+    await response_cache.invalidate("feed")
+
+@change_feed.on("hot_searches")
+async def apply_hot_search_changes(changes: List[dict]):
+    for change in changes:
+        hot = change.get("fullDocument")
+        if hot is None:
+            continue
+        trending_searches.apply_document(hot)
+        suggestion_trie.set_weight(hot["keyword"], hot.get("count", 0) + trending_searches.unflushed(hot["keyword"]))
+    await response_cache.invalidate("search_hot")
+
+@change_feed.on("notification_counters")
+async def apply_unread_count_changes(changes: List[dict]):
+    await unread_count_cache.invalidate("unread_count", [str(change["documentKey"]["_id"]) for change in changes])
+
+@change_feed.on("revoked_tokens")
+async def apply_token_revocations(changes: List[dict]):
+    for change in changes:
+        doc = change.get("fullDocument")
+        if doc is not None:
+            token_revocations.apply_token(doc["_id"], (doc["expires_at"] - datetime(1970, 1, 1)).total_seconds())
+
+@change_feed.on("revoked_users")
+async def apply_user_revocations(changes: List[dict]):
+    for change in changes:
+        doc = change.get("fullDocument")
+        if doc is not None:
+            token_revocations.apply_user(doc["_id"], doc["revoked_before"])
+
+class MediaStore:
+    """Content-addressed blob store on the local filesystem.
+
+    Blobs are named by the SHA-256 of their bytes, so the same image uploaded
+    twice is stored once and documents only keep the hash.
+    """
+
+    SIGNATURES = [
+        (b"\xff\xd8\xff", "image/jpeg"),
+        (b"\x89PNG\r\n\x1a\n", "image/png"),
+        (b"GIF87a", "image/gif"),
+        (b"GIF89a", "image/gif"),
+    ]
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _write(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename so readers never see a partial blob
+            tmp = path.with_name(f"{digest}.{uuid.uuid4().hex}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return digest
+
+    async def put(self, data: bytes) -> str:
+        return await asyncio.to_thread(self._write, data)
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).is_file()
+
+    @classmethod
+    def sniff(cls, data: bytes) -> Optional[str]:
+        """Image type from the leading bytes, or None if it is not a known image."""
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return "image/webp"
+        for signature, content_type in cls.SIGNATURES:
+            if data.startswith(signature):
+                return content_type
+        return None
+
+    def content_type(self, digest: str) -> str:
+        with open(self.path(digest), "rb") as f:
+            head = f.read(12)
+        return self.sniff(head) or "application/octet-stream"
+
+    def read_range(self, digest: str, start: int, end: int):
+        """Yield the bytes in [start, end] in chunks."""
+        with open(self.path(digest), "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(MEDIA_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+media_store = MediaStore(MEDIA_DIR)
+
+MEDIA_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def strip_data_uri(value: str) -> str:
+    # Accept bare base64 as well as data URIs ("data:image/png;base64,...")
+    if value.startswith("data:"):
+        value = value.partition(",")[2]
+    return value
+
+def decode_image(value: str) -> bytes:
+    value = strip_data_uri(value)
+    if len(value) * 3 // 4 > MEDIA_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+    try:
+        data = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid image")
+    # Blobs are served back with the sniffed type, so anything else is refused
+    if MediaStore.sniff(data) is None:
+        raise HTTPException(status_code=400, detail="Unsupported image type")
+    return data
+
+async def store_image(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    return await media_store.put(decode_image(value))
+
+def media_url(digest: Optional[str]) -> Optional[str]:
+    return f"/api/media/{digest}" if digest else None
 
 # Helper Functions
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+def verify_password(password: str, hashed: str) -> bool:
+    if hashed.startswith("$2"):
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+    # Legacy unsalted SHA-256 hex digest
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
 
-def create_access_token(data: dict):
+def password_needs_rehash(hashed: str) -> bool:
+    if not hashed.startswith("$2"):
+        return True
+    # bcrypt hashes look like $2b$<rounds>$<salt+hash>
+    return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+
+async def run_password_task(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, func, *args)
+
+def create_access_token(data: dict, token_type: str = "access", expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    # jti identifies the token for revocation; a float iat orders it against per-user cutoffs
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex, "type": token_type})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def create_refresh_token(data: dict):
+    return create_access_token(data, "refresh", timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+
+def issue_tokens(user_id: str) -> dict:
+    return {
+        "access_token": create_access_token({"user_id": user_id}),
+        "refresh_token": create_refresh_token({"user_id": user_id}),
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+async def get_liked_video_ids(user_id: str, video_ids: List[str]) -> set:
+    """Resolve which of `video_ids` the user has liked with a single query."""
+    if not video_ids:
+        return set()
+    likes = await db.likes.find(
+        {"user_id": user_id, "video_id": {"$in": video_ids}},
+        {"video_id": 1}
+    ).to_list(len(video_ids))
+    return {like["video_id"] for like in likes}
+
+async def get_watched_video_ids(user_id: str, video_ids: List[str]) -> set:
+    """Resolve which of `video_ids` the user has already watched.
+
+    Reads the deduplicated `watched_videos` index (one document per user and
+    video) rather than `watch_history`, which grows with every replay.
+    """
+    if not video_ids:
+        return set()
+    watched = await db.watched_videos.find(
+        {"user_id": user_id, "video_id": {"$in": video_ids}},
+        {"video_id": 1}
+    ).to_list(len(video_ids))
+    # Views still waiting in the write-behind buffer count as watched too
+    return {w["video_id"] for w in watched} | view_buffer.pending_watched(user_id, video_ids)
+
+async def insert_like(collection: str, target_field: str, user_id: str, target_id: str) -> bool:
+    """Atomically create a like, returning True only if this call inserted it.
+
+    Relies on the unique (user_id, target) index so concurrent taps cannot
+    both insert; the loser of a race sees a duplicate key error.
+    """
+    try:
+        result = await db[collection].update_one(
+            {"user_id": user_id, target_field: target_id},
+            {"$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return result.upserted_id is not None
+
+async def get_liked_comment_ids(user_id: str, comment_ids: List[str]) -> set:
+    """Resolve which of `comment_ids` the user has liked with a single query."""
+    if not comment_ids:
+        return set()
+    likes = await db.comment_likes.find(
+        {"user_id": user_id, "comment_id": {"$in": comment_ids}},
+        {"comment_id": 1}
+    ).to_list(len(comment_ids))
+    return {like["comment_id"] for like in likes}
+
+async def get_usernames(user_ids: List[str]) -> Dict[str, str]:
+    """Map user ids to usernames with a single query."""
+    object_ids = [ObjectId(uid) for uid in set(user_ids) if ObjectId.is_valid(uid)]
+    if not object_ids:
+        return {}
+    users = await db.users.find({"_id": {"$in": object_ids}}, {"username": 1}).to_list(len(object_ids))
+    return {str(u["_id"]): u["username"] for u in users}
+
+def conversation_id_for(user_a: str, user_b: str) -> str:
+    # Deterministic id so both participants address the same conversation
+    return "_".join(sorted([user_a, user_b]))
+
+# Cursors are opaque base64 strings wrapping the sort key of the last item served
+def encode_cursor(*parts) -> str:
+    raw = "|".join(str(part) for part in parts).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def optional_part(parse):
+    """Cursor part parser that maps an empty part (encoded from None) back to None."""
+    return lambda part: parse(part) if part else None
+
+def decode_cursor(cursor: str, *types):
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("user_id")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        parts = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if len(parts) != len(types):
+            raise ValueError(cursor)
+        return tuple(parse(part) for parse, part in zip(types, parts))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_cursor(field: str, value, last_id: ObjectId) -> dict:
+    """Query matching items after (`value`, `last_id`) in (`field` desc, _id desc) order."""
+    return {"$or": [
+        {field: {"$lt": value}},
+        {field: value, "_id": {"$lt": last_id}}
+    ]}
+
+def decode_token(token: str, token_type: str = "access") -> dict:
+    """Verify a JWT, reusing cached claims for tokens already seen.
+
+    The cache is keyed by a digest of the token and entries expire with the
+    token, so a hit is as good as a fresh signature check. Revocation is
+    checked on every call since it can happen at any time.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token has expired")
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Could not validate credentials")
+        token_cache.set(key, payload, ttl=payload["exp"] - time.time())
+    
+    # Tokens issued before refresh tokens existed carry no type and act as access tokens
+    if payload.get("type", "access") != token_type or payload.get("user_id") is None:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    if token_revocations.is_revoked(payload):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return payload
+
+async def authenticate_token(token: str):
+    user_id = decode_token(token)["user_id"]
+    user = user_cache.get(user_id)
+    if user is None:
         user = await db.users.find_one({"_id": ObjectId(user_id)})
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Could not validate credentials")
+        user_cache.set(user_id, user)
+    return user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
 
 # Pydantic Models
 class UserRegister(BaseModel):
@@ -74,6 +1854,11 @@ class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+class UserUpdate(BaseModel):
+    username: Optional[str] = None
+    bio: Optional[str] = None
+    avatar: Optional[str] = None
+
 class UserResponse(BaseModel):
     id: str
     email: str
@@ -84,9 +1869,24 @@ class UserResponse(BaseModel):
 
 class TokenResponse(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: str = "bearer"
+    expires_in: int
     user: UserResponse
 
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+class RefreshResponse(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+class Logout(BaseModel):
+    refresh_token: Optional[str] = None
+    all_devices: bool = False
+
 class VideoResponse(BaseModel):
     id: str
     video_url: str
@@ -106,6 +1906,7 @@ class CommentResponse(BaseModel):
     id: str
     user_id: str
     username: str
+    avatar: Optional[str] = None
     text: str
     image: Optional[str] = None
     likes_count: int
@@ -119,14 +1920,25 @@ class MessageCreate(BaseModel):
 
 class MessageResponse(BaseModel):
     id: str
+    conversation_id: Optional[str] = None
     sender_id: str
     sender_username: str
+    sender_avatar: Optional[str] = None
     receiver_id: str
     text: str
     image: Optional[str] = None
     read: bool
     created_at: datetime
 
+class ConversationResponse(BaseModel):
+    id: str
+    peer_id: str
+    peer_username: str
+    last_message: str
+    last_sender_id: str
+    unread_count: int
+    updated_at: datetime
+
 class NotificationResponse(BaseModel):
     id: str
     type: str  # 'follow', 'like', 'comment'
@@ -134,9 +1946,17 @@ class NotificationResponse(BaseModel):
     from_username: str
     content: str
     video_id: Optional[str] = None
+    count: int = 1  # people folded into this notification, e.g. likes on one video
     read: bool
     created_at: datetime
 
+class NotificationsRead(BaseModel):
+    ids: Optional[List[str]] = None
+    up_to: Optional[datetime] = None  # mark everything created at or before this
+
+class UnreadCountResponse(BaseModel):
+    unread: int
+
 class SearchHistoryResponse(BaseModel):
     id: str
     keyword: str
@@ -155,6 +1975,124 @@ class WatchHistory(BaseModel):
     video_id: str
     watch_duration: float
 
+# Index provisioning: (collection, keys, options) for every query the handlers run
+INDEXES = [
+    ("users", [("email", 1)], {"unique": True}),
+    ("users", [("profile_sync_pending", 1)], {"sparse": True}),
+    ("videos", [("engagement_score", -1), ("_id", -1)], {}),
+    ("likes", [("user_id", 1), ("video_id", 1)], {"unique": True}),
+    ("comment_likes", [("user_id", 1), ("comment_id", 1)], {"unique": True}),
+    ("follows", [("follower_id", 1), ("following_id", 1)], {"unique": True}),
+    ("watch_history", [("user_id", 1), ("created_at", -1)], {}),
+    ("watched_videos", [("user_id", 1), ("video_id", 1)], {"unique": True}),
+    ("comments", [("video_id", 1), ("created_at", -1), ("_id", -1)], {}),
+    ("comments", [("user_id", 1)], {}),
+    ("messages", [("sender_id", 1), ("created_at", -1)], {}),
+    ("messages", [("receiver_id", 1), ("created_at", -1)], {}),
+    ("messages", [("conversation_id", 1), ("created_at", -1), ("_id", -1)], {}),
+    ("conversations", [("participants", 1), ("updated_at", -1), ("_id", -1)], {}),
+    ("notifications", [("user_id", 1), ("created_at", -1)], {}),
+    ("notifications", [("from_user_id", 1)], {}),
+    ("notifications", [("user_id", 1), ("video_id", 1)], {}),
+    ("search_history", [("user_id", 1), ("created_at", -1)], {}),
+    ("hot_searches", [("keyword", 1)], {"unique": True}),
+    ("hot_searches", [("count", -1)], {}),
+    ("revoked_tokens", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("locks", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("realtime_events", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+]
+
+# Representative handler queries, explained at startup to spot collection scans
+QUERY_PROBES = [
+    ("users", {"email": ""}, None),
+    ("videos", {}, [("engagement_score", -1), ("_id", -1)]),
+    ("likes", {"user_id": "", "video_id": {"$in": [""]}}, None),
+    ("comment_likes", {"user_id": "", "comment_id": {"$in": [""]}}, None),
+    ("follows", {"follower_id": "", "following_id": ""}, None),
+    ("watched_videos", {"user_id": "", "video_id": {"$in": [""]}}, None),
+    ("comments", {"video_id": ""}, [("created_at", -1), ("_id", -1)]),
+    ("messages", {"$or": [{"sender_id": ""}, {"receiver_id": ""}]}, [("created_at", -1)]),
+    ("messages", {"conversation_id": ""}, [("created_at", -1), ("_id", -1)]),
+    ("conversations", {"participants": ""}, [("updated_at", -1), ("_id", -1)]),
+    ("notifications", {"user_id": ""}, [("created_at", -1)]),
+    ("search_history", {"user_id": ""}, [("created_at", -1)]),
+    ("hot_searches", {}, [("count", -1)]),
+]
+
+async def remove_duplicate_likes():
+    # The old find-then-insert like path could store the same like twice and
+    # count it twice; clean that up before the unique indexes are built
+    for collection, target_field, target_collection, weight in [
+        ("likes", "video_id", "videos", ENGAGEMENT_WEIGHTS["likes_count"]),
+        ("comment_likes", "comment_id", "comments", 0),
+    ]:
+        indexes = await db[collection].index_information()
+        if any(index.get("unique") for name, index in indexes.items() if name != "_id_"):
+            continue
+        duplicates = await db[collection].aggregate([
+            {"$group": {
+                "_id": {"user_id": "$user_id", "target_id": f"${target_field}"},
+                "ids": {"$push": "$_id"},
+                "count": {"$sum": 1}
+            }},
+            {"$match": {"count": {"$gt": 1}}}
+        ]).to_list(None)
+        for duplicate in duplicates:
+            extra = duplicate["count"] - 1
+            await db[collection].delete_many({"_id": {"$in": duplicate["ids"][1:]}})
+            target_id = duplicate["_id"]["target_id"]
+            if ObjectId.is_valid(target_id):
+                inc = {"likes_count": -extra}
+                if weight:
+                    inc["engagement_score"] = -extra * weight
+                await db[target_collection].update_one({"_id": ObjectId(target_id)}, {"$inc": inc})
+        if duplicates:
+            logger.info(f"Removed duplicate {collection} for {len(duplicates)} user/target pairs")
+
+async def remove_duplicate_follows():
+    # Follows were also created with find-then-insert; keep the oldest of each
+    # pair so the unique index can be built
+    indexes = await db.follows.index_information()
+    if any(index.get("unique") for name, index in indexes.items() if name != "_id_"):
+        return
+    duplicates = await db.follows.aggregate([
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {"follower_id": "$follower_id", "following_id": "$following_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]).to_list(None)
+    for duplicate in duplicates:
+        await db.follows.delete_many({"_id": {"$in": duplicate["ids"][1:]}})
+    if duplicates:
+        logger.info(f"Removed duplicate follows for {len(duplicates)} follower/followee pairs")
+
+async def ensure_indexes():
+    # create_index is a no-op when an identical index already exists
+    for collection, keys, options in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception:
+            logger.exception(f"Could not create index {keys} on {collection}")
+
+async def report_collection_scans():
+    scans = []
+    for collection, query, sort in QUERY_PROBES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            plan = await cursor.explain()
+        except Exception as e:
+            logger.debug(f"Could not explain query on {collection}: {e}")
+            continue
+        if "COLLSCAN" in str(plan.get("queryPlanner", {}).get("winningPlan")):
+            scans.append(collection)
+            logger.warning(f"Query {query} on {collection} still does a collection scan")
+    return scans
+
 # Initialize sample videos
 async def initialize_videos():
     count = await db.videos.count_documents({})
@@ -168,6 +2106,7 @@ async def initialize_videos():
                 "likes_count": 0,
                 "comments_count": 0,
                 "views": 0,
+                "engagement_score": 0,
                 "created_at": datetime.utcnow()
             },
             {
@@ -178,6 +2117,7 @@ async def initialize_videos():
                 "likes_count": 0,
                 "comments_count": 0,
                 "views": 0,
+                "engagement_score": 0,
                 "created_at": datetime.utcnow()
             },
             {
@@ -188,6 +2128,7 @@ async def initialize_videos():
                 "likes_count": 0,
                 "comments_count": 0,
                 "views": 0,
+                "engagement_score": 0,
                 "created_at": datetime.utcnow()
             },
             {
@@ -198,6 +2139,7 @@ async def initialize_videos():
                 "likes_count": 0,
                 "comments_count": 0,
                 "views": 0,
+                "engagement_score": 0,
                 "created_at": datetime.utcnow()
             },
             {
@@ -208,12 +2150,164 @@ async def initialize_videos():
                 "likes_count": 0,
                 "comments_count": 0,
                 "views": 0,
+                "engagement_score": 0,
                 "created_at": datetime.utcnow()
             }
         ]
         await db.videos.insert_many(sample_videos)
         logger.info("Sample videos initialized")
 
+async def backfill_engagement_scores():
+    # Videos created before the ranking field existed get it computed once
+    result = await db.videos.update_many(
+        {"engagement_score": {"$exists": False}},
+        [{"$set": {"engagement_score": {"$add": [
+            {"$multiply": [{"$ifNull": [f"${field}", 0]}, weight]}
+            for field, weight in ENGAGEMENT_WEIGHTS.items()
+        ]}}}]
+    )
+    if result.modified_count:
+        logger.info(f"Backfilled engagement score on {result.modified_count} videos")
+
+async def backfill_watched_videos():
+    # Build the deduplicated watched index from existing watch history once
+    if await db.watched_videos.estimated_document_count() > 0:
+        return
+    pairs = await db.watch_history.aggregate([
+        {"$group": {
+            "_id": {"user_id": "$user_id", "video_id": "$video_id"},
+            "watch_count": {"$sum": 1},
+            "last_watched_at": {"$max": "$created_at"}
+        }}
+    ]).to_list(None)
+    if pairs:
+        await db.watched_videos.insert_many([{
+            "_id": ObjectId(),
+            "user_id": p["_id"]["user_id"],
+            "video_id": p["_id"]["video_id"],
+            "watch_count": p["watch_count"],
+            "last_watched_at": p["last_watched_at"]
+        } for p in pairs])
+        logger.info(f"Backfilled {len(pairs)} watched video entries")
+
+async def backfill_conversations():
+    # Messages sent before conversations existed get a conversation id and summary
+    legacy = await db.messages.find(
+        {"conversation_id": {"$exists": False}}, {"sender_id": 1, "receiver_id": 1}
+    ).to_list(None)
+    if not legacy:
+        return
+    
+    conversation_ids = set()
+    updates = []
+    for msg in legacy:
+        conversation_id = conversation_id_for(msg["sender_id"], msg["receiver_id"])
+        conversation_ids.add(conversation_id)
+        updates.append(UpdateOne({"_id": msg["_id"]}, {"$set": {"conversation_id": conversation_id}}))
+    await db.messages.bulk_write(updates, ordered=False)
+    
+    summaries = await db.messages.aggregate([
+        {"$match": {"conversation_id": {"$in": list(conversation_ids)}}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": "$conversation_id",
+            "last_message": {"$last": "$text"},
+            "last_sender_id": {"$last": "$sender_id"},
+            "updated_at": {"$last": "$created_at"},
+            "unread": {"$push": {"$cond": [{"$eq": ["$read", False]}, "$receiver_id", None]}}
+        }}
+    ]).to_list(None)
+    
+    conversations = []
+    for summary in summaries:
+        unread = {}
+        for receiver_id in summary["unread"]:
+            if receiver_id is not None:
+                unread[receiver_id] = unread.get(receiver_id, 0) + 1
+        conversations.append(UpdateOne({"_id": summary["_id"]}, {"$set": {
+            "participants": summary["_id"].split("_"),
+            "last_message": summary["last_message"],
+            "last_sender_id": summary["last_sender_id"],
+            "updated_at": summary["updated_at"],
+            "unread": unread
+        }}, upsert=True))
+    await db.conversations.bulk_write(conversations, ordered=False)
+    logger.info(f"Backfilled {len(legacy)} messages into {len(conversations)} conversations")
+
+async def backfill_conversation_usernames():
+    # Conversations created before usernames were stored on them get them once
+    conversations = await db.conversations.find(
+        {"usernames": {"$exists": False}}, {"participants": 1}
+    ).to_list(None)
+    if not conversations:
+        return
+    
+    usernames = await get_usernames([p for conv in conversations for p in conv["participants"]])
+    await db.conversations.bulk_write([
+        UpdateOne({"_id": conv["_id"]}, {"$set": {"usernames": {
+            p: usernames[p] for p in conv["participants"] if p in usernames
+        }}}) for conv in conversations
+    ], ordered=False)
+    logger.info(f"Backfilled usernames on {len(conversations)} conversations")
+
+async def backfill_author_snapshots():
+    # Comments and messages written before authors were snapshotted get them once
+    for collection, (author_field, fields) in ProfileReconciler.SNAPSHOTS.items():
+        snapshot_field = fields["username"]
+        author_ids = await db[collection].distinct(author_field, {snapshot_field: {"$exists": False}})
+        if not author_ids:
+            continue
+        
+        object_ids = [ObjectId(uid) for uid in author_ids if ObjectId.is_valid(uid)]
+        users = await db.users.find(
+            {"_id": {"$in": object_ids}}, {"username": 1, "avatar": 1}
+        ).to_list(len(object_ids))
+        if not users:
+            continue
+        await db[collection].bulk_write([
+            UpdateMany(
+                {author_field: str(u["_id"]), snapshot_field: {"$exists": False}},
+                {"$set": {fields[k]: u.get(k) for k in fields}}
+            ) for u in users
+        ], ordered=False)
+        logger.info(f"Backfilled author snapshots for {len(users)} users on {collection}")
+
+async def backfill_media():
+    # Images stored inline as base64 before the blob store existed are moved into it
+    for collection in ["comments", "messages"]:
+        moved = 0
+        # Each batch unsets `image` or marks it as failed, so the same query
+        # returns the next batch
+        while True:
+            legacy = await db[collection].find(
+                {"image": {"$type": "string"}, "image_backfill_failed": {"$exists": False}},
+                {"image": 1}
+            ).limit(MEDIA_BACKFILL_BATCH_SIZE).to_list(MEDIA_BACKFILL_BATCH_SIZE)
+            if not legacy:
+                break
+            
+            updates = []
+            for doc in legacy:
+                # Legacy images predate the type and size checks; they are kept
+                # as-is and served as application/octet-stream if not sniffable
+                try:
+                    data = base64.b64decode(strip_data_uri(doc["image"]))
+                except (binascii.Error, ValueError):
+                    logger.warning(f"Keeping undecodable inline image on {collection} {doc['_id']}")
+                    updates.append(UpdateOne(
+                        {"_id": doc["_id"]}, {"$set": {"image_backfill_failed": True}}
+                    ))
+                    continue
+                digest = await media_store.put(data) if data else None
+                updates.append(UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": {"image_hash": digest}, "$unset": {"image": ""}}
+                ))
+            await db[collection].bulk_write(updates, ordered=False)
+            moved += len(updates)
+        if moved:
+            logger.info(f"Moved {moved} inline images on {collection} to the media store")
+
 # Authentication Routes
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(user_data: UserRegister):
@@ -226,17 +2320,26 @@ async def register(user_data: UserRegister):
     user_dict = {
         "_id": ObjectId(),
         "email": user_data.email,
-        "password": hash_password(user_data.password),
+        "password": await run_password_task(hash_password, user_data.password),
         "username": user_data.username,
         "bio": user_data.bio,
         "avatar": None,
         "created_at": datetime.utcnow()
     }
     
-    await db.users.insert_one(user_dict)
+    # The unique email index settles concurrent registrations of the same address
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Create token
-    token = create_access_token({"user_id": str(user_dict["_id"])})
+    # Searchable on this worker straight away, even with the change feed off;
+    # the feed repeats this harmlessly and carries it to the other workers
+    user_search_index.add(str(user_dict["_id"]), user_dict)
+    suggestion_trie.add(user_dict["username"])
+    
+    # Create tokens
+    tokens = issue_tokens(str(user_dict["_id"]))
     
     user_response = UserResponse(
         id=str(user_dict["_id"]),
@@ -247,15 +2350,21 @@ async def register(user_data: UserRegister):
         created_at=user_dict["created_at"]
     )
     
-    return TokenResponse(access_token=token, user=user_response)
+    return TokenResponse(**tokens, user=user_response)
 
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email})
-    if not user or user["password"] != hash_password(credentials.password):
+    if not user or not await run_password_task(verify_password, credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    token = create_access_token({"user_id": str(user["_id"])})
+    # Upgrade legacy SHA-256 hashes (or an outdated cost factor) transparently
+    if password_needs_rehash(user["password"]):
+        new_hash = await run_password_task(hash_password, credentials.password)
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
+        user_cache.invalidate(str(user["_id"]))
+    
+    tokens = issue_tokens(str(user["_id"]))
     
     user_response = UserResponse(
         id=str(user["_id"]),
@@ -266,7 +2375,45 @@ async def login(credentials: UserLogin):
         created_at=user["created_at"]
     )
     
-    return TokenResponse(access_token=token, user=user_response)
+    return TokenResponse(**tokens, user=user_response)
+
+@api_router.post("/auth/refresh", response_model=RefreshResponse)
+async def refresh_tokens(data: TokenRefresh):
+    claims = decode_token(data.refresh_token, "refresh")
+    # Refresh tokens are single-use: the presented one is retired and a new pair issued
+    if not await token_revocations.consume(claims):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return RefreshResponse(**issue_tokens(claims["user_id"]))
+
+@api_router.post("/auth/logout")
+async def logout(data: Logout, credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    # Access tokens are short-lived, so the refresh token alone is enough to log out
+    access_claims = refresh_claims = None
+    if credentials is not None:
+        try:
+            access_claims = decode_token(credentials.credentials)
+        except HTTPException:
+            pass
+    if data.refresh_token:
+        try:
+            refresh_claims = decode_token(data.refresh_token, "refresh")
+        except HTTPException:
+            pass
+    if access_claims and refresh_claims and refresh_claims["user_id"] != access_claims["user_id"]:
+        refresh_claims = None
+    claims = access_claims or refresh_claims
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    
+    if data.all_devices:
+        await token_revocations.revoke_user(claims["user_id"])
+        return {"success": True}
+    
+    if access_claims:
+        await token_revocations.revoke(access_claims)
+    if refresh_claims:
+        await token_revocations.consume(refresh_claims)
+    return {"success": True}
 
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_me(current_user = Depends(get_current_user)):
@@ -279,69 +2426,116 @@ async def get_me(current_user = Depends(get_current_user)):
         created_at=current_user["created_at"]
     )
 
+@api_router.put("/auth/me", response_model=UserResponse)
+async def update_me(user_data: UserUpdate, current_user = Depends(get_current_user)):
+    user_id = str(current_user["_id"])
+    # Omitted and null fields are both left unchanged
+    updates = user_data.model_dump(exclude_none=True)
+    
+    if updates:
+        profile = {k: v for k, v in updates.items() if k in ("username", "avatar")}
+        flags = {"profile_sync_pending": True} if profile else {}
+        await db.users.update_one({"_id": current_user["_id"]}, {"$set": {**updates, **flags}})
+        # Update this worker's cache and search structures here so the caller sees
+        # the new profile at once; other workers follow via the change feed
+        user_cache.invalidate(user_id)
+        if "username" in updates:
+            suggestion_trie.remove(current_user["username"])
+            user_search_index.add(user_id, updates)
+            suggestion_trie.add(updates["username"])
+        if profile:
+            profile_reconciler.record(user_id, profile)
+    
+    user = {**current_user, **updates}
+    return UserResponse(
+        id=user_id,
+        email=user["email"],
+        username=user["username"],
+        bio=user["bio"],
+        avatar=user.get("avatar"),
+        created_at=user["created_at"]
+    )
+
 # Video Routes
+def video_response(video: dict, is_liked: bool) -> VideoResponse:
+    return VideoResponse(
+        id=str(video["_id"]),
+        video_url=video["video_url"],
+        title=video["title"],
+        author=video["author"],
+        likes_count=video["likes_count"],
+        comments_count=video["comments_count"],
+        views=video["views"],
+        created_at=video["created_at"],
+        is_liked=is_liked
+    )
+
 @api_router.get("/videos/feed", response_model=List[VideoResponse])
-async def get_video_feed(current_user = Depends(get_current_user)):
+async def get_video_feed(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),
+    current_user = Depends(get_current_user)
+):
     user_id = str(current_user["_id"])
     
-    # Get watch history
-    watch_history = await db.watch_history.find({"user_id": user_id}).to_list(1000)
-    watched_video_ids = [wh["video_id"] for wh in watch_history]
-    
-    # Get all videos
-    videos = await db.videos.find().to_list(1000)
+    # Walk the pre-ranked videos: phase 0 serves unwatched videos, phase 1
+    # then serves the watched ones, both by descending engagement score
+    phase, last_score, last_id = (
+        decode_cursor(cursor, int, optional_part(int), optional_part(ObjectId)) if cursor else (0, None, None)
+    )
     
-    # Simple recommendation: prioritize unwatched, then by engagement score
-    video_responses = []
-    for video in videos:
-        video_id = str(video["_id"])
+    page = []
+    exhausted = False
+    batch_size = max(limit, FEED_PAGE_SIZE)
+    for _ in range(FEED_MAX_SCAN_BATCHES):
+        # The ranked slice is the same for everyone, so it is cached briefly
+        cache_key = f"{last_score}|{last_id}|{batch_size}"
+        batch = await response_cache.get("feed", cache_key)
+        if batch is None:
+            query = after_cursor("engagement_score", last_score, last_id) if last_id is not None else {}
+            batch = await response_cache.set("feed", cache_key, await read_db.videos.find(query).sort(
+                [("engagement_score", -1), ("_id", -1)]
+            ).limit(batch_size).to_list(batch_size))
         
-        # Check if user liked this video
-        is_liked = await db.likes.find_one({"user_id": user_id, "video_id": video_id}) is not None
+        if not batch:
+            if phase == 0:
+                phase, last_score, last_id = 1, None, None
+                continue
+            exhausted = True
+            break
         
-        # Calculate engagement score
-        engagement_score = video["likes_count"] * 2 + video["comments_count"] * 3 + video["views"]
-        is_watched = video_id in watched_video_ids
-        
-        video_responses.append({
-            "video": VideoResponse(
-                id=video_id,
-                video_url=video["video_url"],
-                title=video["title"],
-                author=video["author"],
-                likes_count=video["likes_count"],
-                comments_count=video["comments_count"],
-                views=video["views"],
-                created_at=video["created_at"],
-                is_liked=is_liked
-            ),
-            "engagement_score": engagement_score,
-            "is_watched": is_watched
-        })
-    
-    # Sort: unwatched first, then by engagement score
-    video_responses.sort(key=lambda x: (x["is_watched"], -x["engagement_score"]))
-    
-    return [vr["video"] for vr in video_responses]
+        watched_video_ids = await get_watched_video_ids(user_id, [str(video["_id"]) for video in batch])
+        for video in batch:
+            last_score, last_id = video.get("engagement_score", 0), video["_id"]
+            is_watched = str(video["_id"]) in watched_video_ids
+            if is_watched == bool(phase):
+                page.append(video)
+                if len(page) == limit:
+                    break
+        if len(page) == limit:
+            break
+    
+    if not exhausted:
+        # The position is empty when the budget ran out right as phase 1 began
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            phase, "" if last_id is None else last_score, "" if last_id is None else last_id
+        )
+    
+    # Resolve like state for the whole page in one round trip
+    liked_video_ids = await get_liked_video_ids(user_id, [str(video["_id"]) for video in page])
+    
+    return [video_response(video, str(video["_id"]) in liked_video_ids) for video in page]
 
 @api_router.post("/videos/{video_id}/view")
 async def record_view(video_id: str, watch_data: WatchHistory, current_user = Depends(get_current_user)):
     user_id = str(current_user["_id"])
     
-    # Record watch history
-    await db.watch_history.insert_one({
-        "_id": ObjectId(),
-        "user_id": user_id,
-        "video_id": video_id,
-        "watch_duration": watch_data.watch_duration,
-        "created_at": datetime.utcnow()
-    })
+    if not ObjectId.is_valid(video_id):
+        raise HTTPException(status_code=400, detail="Invalid video id")
     
-    # Increment view count
-    await db.videos.update_one(
-        {"_id": ObjectId(video_id)},
-        {"$inc": {"views": 1}}
-    )
+    # Watch history, watched index and view count are written behind in batches
+    view_buffer.record(user_id, video_id, watch_data.watch_duration)
     
     return {"success": True}
 
@@ -350,25 +2544,26 @@ async def record_view(video_id: str, watch_data: WatchHistory, current_user = De
 async def like_video(video_id: str, current_user = Depends(get_current_user)):
     user_id = str(current_user["_id"])
     
-    # Check if already liked
-    existing_like = await db.likes.find_one({"user_id": user_id, "video_id": video_id})
-    if existing_like:
+    # Create like; the count only moves if this request inserted it
+    if not await insert_like("likes", "video_id", user_id, video_id):
         raise HTTPException(status_code=400, detail="Already liked")
     
-    # Create like
-    await db.likes.insert_one({
-        "_id": ObjectId(),
-        "user_id": user_id,
-        "video_id": video_id,
-        "created_at": datetime.utcnow()
-    })
-    
     # Increment like count
     await db.videos.update_one(
         {"_id": ObjectId(video_id)},
-        {"$inc": {"likes_count": 1}}
+        {"$inc": {"likes_count": 1, "engagement_score": ENGAGEMENT_WEIGHTS["likes_count"]}}
     )
     
+    # Notify the video owner in the background
+    notification_pipeline.submit({
+        "user_id": None,
+        "type": "like",
+        "from_user_id": user_id,
+        "from_username": current_user["username"],
+        "content": "赞了你的视频",
+        "video_id": video_id
+    })
+    
     return {"success": True}
 
 @api_router.delete("/videos/{video_id}/like")
@@ -383,37 +2578,49 @@ async def unlike_video(video_id: str, current_user = Depends(get_current_user)):
     # Decrement like count
     await db.videos.update_one(
         {"_id": ObjectId(video_id)},
-        {"$inc": {"likes_count": -1}}
+        {"$inc": {"likes_count": -1, "engagement_score": -ENGAGEMENT_WEIGHTS["likes_count"]}}
     )
     
     return {"success": True}
 
 # Comment Routes
 @api_router.get("/videos/{video_id}/comments", response_model=List[CommentResponse])
-async def get_comments(video_id: str, current_user = Depends(get_current_user)):
+async def get_comments(
+    video_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(COMMENTS_PAGE_SIZE, ge=1, le=COMMENTS_MAX_PAGE_SIZE),
+    current_user = Depends(get_current_user)
+):
     user_id = str(current_user["_id"])
-    comments = await db.comments.find({"video_id": video_id}).sort("created_at", -1).to_list(1000)
     
-    result = []
-    for comment in comments:
-        user = await db.users.find_one({"_id": ObjectId(comment["user_id"])})
-        comment_id = str(comment["_id"])
-        
-        # Check if user liked this comment
-        is_liked = await db.comment_likes.find_one({"user_id": user_id, "comment_id": comment_id}) is not None
-        
-        result.append(CommentResponse(
-            id=comment_id,
-            user_id=comment["user_id"],
-            username=user["username"] if user else "Unknown",
-            text=comment["text"],
-            image=comment.get("image"),
-            likes_count=comment.get("likes_count", 0),
-            is_liked=is_liked,
-            created_at=comment["created_at"]
-        ))
-    
-    return result
+    query = {"video_id": video_id}
+    if cursor:
+        last_created_at, last_id = decode_cursor(cursor, datetime.fromisoformat, ObjectId)
+        query.update(after_cursor("created_at", last_created_at, last_id))
+    
+    comments = await read_db.comments.find(query).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).limit(limit).to_list(limit)
+    
+    if len(comments) == limit:
+        last = comments[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"].isoformat(), last["_id"])
+    
+    # Authors are snapshotted on each comment, so only like state needs a lookup
+    liked_comment_ids = await get_liked_comment_ids(user_id, [str(comment["_id"]) for comment in comments])
+    
+    return [CommentResponse(
+        id=str(comment["_id"]),
+        user_id=comment["user_id"],
+        username=comment.get("username", "Unknown"),
+        avatar=comment.get("avatar"),
+        text=comment["text"],
+        image=media_url(comment.get("image_hash")),
+        likes_count=comment.get("likes_count", 0),
+        is_liked=str(comment["_id"]) in liked_comment_ids,
+        created_at=comment["created_at"]
+    ) for comment in comments]
 
 @api_router.post("/videos/{video_id}/comments", response_model=CommentResponse)
 async def create_comment(video_id: str, comment_data: CommentCreate, current_user = Depends(get_current_user)):
@@ -422,9 +2629,11 @@ async def create_comment(video_id: str, comment_data: CommentCreate, current_use
     comment_dict = {
         "_id": ObjectId(),
         "user_id": user_id,
+        "username": current_user["username"],
+        "avatar": current_user.get("avatar"),
         "video_id": video_id,
         "text": comment_data.text,
-        "image": comment_data.image,
+        "image_hash": await store_image(comment_data.image),
         "likes_count": 0,
         "created_at": datetime.utcnow()
     }
@@ -434,30 +2643,26 @@ async def create_comment(video_id: str, comment_data: CommentCreate, current_use
     # Increment comment count
     await db.videos.update_one(
         {"_id": ObjectId(video_id)},
-        {"$inc": {"comments_count": 1}}
+        {"$inc": {"comments_count": 1, "engagement_score": ENGAGEMENT_WEIGHTS["comments_count"]}}
     )
     
-    # Create notification for video owner
-    video = await db.videos.find_one({"_id": ObjectId(video_id)})
-    if video:
-        await db.notifications.insert_one({
-            "_id": ObjectId(),
-            "user_id": video.get("author_id", ""),
-            "type": "comment",
-            "from_user_id": user_id,
-            "from_username": current_user["username"],
-            "content": f"评论了你的视频",
-            "video_id": video_id,
-            "read": False,
-            "created_at": datetime.utcnow()
-        })
+    # Notify the video owner in the background
+    notification_pipeline.submit({
+        "user_id": None,
+        "type": "comment",
+        "from_user_id": user_id,
+        "from_username": current_user["username"],
+        "content": "评论了你的视频",
+        "video_id": video_id
+    })
     
     return CommentResponse(
         id=str(comment_dict["_id"]),
         user_id=user_id,
-        username=current_user["username"],
+        username=comment_dict["username"],
+        avatar=comment_dict["avatar"],
         text=comment_dict["text"],
-        image=comment_dict.get("image"),
+        image=media_url(comment_dict["image_hash"]),
         likes_count=0,
         is_liked=False,
         created_at=comment_dict["created_at"]
@@ -468,19 +2673,10 @@ async def create_comment(video_id: str, comment_data: CommentCreate, current_use
 async def like_comment(comment_id: str, current_user = Depends(get_current_user)):
     user_id = str(current_user["_id"])
     
-    # Check if already liked
-    existing_like = await db.comment_likes.find_one({"user_id": user_id, "comment_id": comment_id})
-    if existing_like:
+    # Create like; the count only moves if this request inserted it
+    if not await insert_like("comment_likes", "comment_id", user_id, comment_id):
         raise HTTPException(status_code=400, detail="Already liked")
     
-    # Create like
-    await db.comment_likes.insert_one({
-        "_id": ObjectId(),
-        "user_id": user_id,
-        "comment_id": comment_id,
-        "created_at": datetime.utcnow()
-    })
-    
     # Increment like count
     await db.comments.update_one(
         {"_id": ObjectId(comment_id)},
@@ -507,6 +2703,20 @@ async def unlike_comment(comment_id: str, current_user = Depends(get_current_use
     return {"success": True}
 
 # Message Routes
+def message_response(msg: dict) -> MessageResponse:
+    return MessageResponse(
+        id=str(msg["_id"]),
+        conversation_id=msg.get("conversation_id"),
+        sender_id=msg["sender_id"],
+        sender_username=msg.get("sender_username", "Unknown"),
+        sender_avatar=msg.get("sender_avatar"),
+        receiver_id=msg["receiver_id"],
+        text=msg["text"],
+        image=media_url(msg.get("image_hash")),
+        read=msg.get("read", False),
+        created_at=msg["created_at"]
+    )
+
 @api_router.get("/messages", response_model=List[MessageResponse])
 async def get_messages(current_user = Depends(get_current_user)):
     user_id = str(current_user["_id"])
@@ -518,73 +2728,230 @@ async def get_messages(current_user = Depends(get_current_user)):
         ]
     }).sort("created_at", -1).to_list(1000)
     
-    result = []
-    for msg in messages:
-        sender = await db.users.find_one({"_id": ObjectId(msg["sender_id"])})
-        result.append(MessageResponse(
-            id=str(msg["_id"]),
-            sender_id=msg["sender_id"],
-            sender_username=sender["username"] if sender else "Unknown",
-            receiver_id=msg["receiver_id"],
-            text=msg["text"],
-            image=msg.get("image"),
-            read=msg.get("read", False),
-            created_at=msg["created_at"]
-        ))
-    
-    return result
+    return [message_response(msg) for msg in messages]
 
 @api_router.post("/messages", response_model=MessageResponse)
 async def send_message(message_data: MessageCreate, current_user = Depends(get_current_user)):
     user_id = str(current_user["_id"])
+    if not ObjectId.is_valid(message_data.receiver_id):
+        raise HTTPException(status_code=400, detail="Invalid receiver id")
+    receiver = await db.users.find_one({"_id": ObjectId(message_data.receiver_id)}, {"username": 1})
+    if receiver is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    receiver_id = str(receiver["_id"])
+    conversation_id = conversation_id_for(user_id, receiver_id)
     
     message_dict = {
         "_id": ObjectId(),
+        "conversation_id": conversation_id,
         "sender_id": user_id,
-        "receiver_id": message_data.receiver_id,
+        "sender_username": current_user["username"],
+        "sender_avatar": current_user.get("avatar"),
+        "receiver_id": receiver_id,
         "text": message_data.text,
-        "image": message_data.image,
+        "image_hash": await store_image(message_data.image),
         "read": False,
         "created_at": datetime.utcnow()
     }
     
     await db.messages.insert_one(message_dict)
     
-    return MessageResponse(
-        id=str(message_dict["_id"]),
-        sender_id=user_id,
-        sender_username=current_user["username"],
-        receiver_id=message_data.receiver_id,
-        text=message_dict["text"],
-        image=message_dict.get("image"),
-        read=False,
-        created_at=message_dict["created_at"]
+    # Keep the conversation summary current for the inbox
+    await db.conversations.update_one(
+        {"_id": conversation_id},
+        {
+            "$set": {
+                "participants": conversation_id.split("_"),
+                "last_message": message_dict["text"],
+                "last_sender_id": user_id,
+                "updated_at": message_dict["created_at"],
+                # Both names are kept on the summary so the inbox needs no users lookup
+                f"usernames.{user_id}": current_user["username"],
+                f"usernames.{receiver_id}": receiver["username"]
+            },
+            "$inc": {f"unread.{receiver_id}": 1}
+        },
+        upsert=True
     )
+    
+    message = message_response(message_dict)
+    await publish_to_user(receiver_id, "message", message)
+    return message
 
-# Notification Routes
-@api_router.get("/notifications", response_model=List[NotificationResponse])
-async def get_notifications(current_user = Depends(get_current_user)):
+@api_router.get("/conversations", response_model=List[ConversationResponse])
+async def get_conversations(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(CONVERSATIONS_PAGE_SIZE, ge=1, le=CONVERSATIONS_MAX_PAGE_SIZE),
+    current_user = Depends(get_current_user)
+):
     user_id = str(current_user["_id"])
     
-    notifications = await db.notifications.find({"user_id": user_id}).sort("created_at", -1).to_list(1000)
+    query = {"participants": user_id}
+    if cursor:
+        last_updated_at, last_id = decode_cursor(cursor, datetime.fromisoformat, str)
+        query.update(after_cursor("updated_at", last_updated_at, last_id))
+    
+    conversations = await db.conversations.find(query).sort(
+        [("updated_at", -1), ("_id", -1)]
+    ).limit(limit).to_list(limit)
+    
+    if len(conversations) == limit:
+        last = conversations[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["updated_at"].isoformat(), last["_id"])
+    
+    peer_ids = {
+        conv["_id"]: next((p for p in conv["participants"] if p != user_id), user_id)
+        for conv in conversations
+    }
+    
+    return [ConversationResponse(
+        id=conv["_id"],
+        peer_id=peer_ids[conv["_id"]],
+        peer_username=conv.get("usernames", {}).get(peer_ids[conv["_id"]], "Unknown"),
+        last_message=conv["last_message"],
+        last_sender_id=conv["last_sender_id"],
+        unread_count=conv.get("unread", {}).get(user_id, 0),
+        updated_at=conv["updated_at"]
+    ) for conv in conversations]
+
+@api_router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
+async def get_conversation_messages(
+    conversation_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=MESSAGES_MAX_PAGE_SIZE),
+    current_user = Depends(get_current_user)
+):
+    user_id = str(current_user["_id"])
+    participants = conversation_id.split("_")
+    if user_id not in participants:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    query = {"conversation_id": conversation_id}
+    if cursor:
+        last_created_at, last_id = decode_cursor(cursor, datetime.fromisoformat, ObjectId)
+        query.update(after_cursor("created_at", last_created_at, last_id))
+    
+    messages = await db.messages.find(query).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).limit(limit).to_list(limit)
+    
+    if len(messages) == limit:
+        last = messages[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"].isoformat(), last["_id"])
+    
+    return [message_response(msg) for msg in messages]
+
+@api_router.post("/conversations/{conversation_id}/read")
+async def mark_conversation_read(conversation_id: str, current_user = Depends(get_current_user)):
+    user_id = str(current_user["_id"])
+    if user_id not in conversation_id.split("_"):
+        raise HTTPException(status_code=404, detail="Conversation not found")
     
-    return [NotificationResponse(
+    await db.messages.update_many(
+        {"conversation_id": conversation_id, "receiver_id": user_id, "read": False},
+        {"$set": {"read": True}}
+    )
+    await db.conversations.update_one(
+        {"_id": conversation_id},
+        {"$set": {f"unread.{user_id}": 0}}
+    )
+    return {"success": True}
+
+# Notification Routes
+async def adjust_unread_counts(user_ids: List[str], delta: int):
+    # Unread badges are per-user counters kept next to the notifications
+    increments: Dict[str, int] = {}
+    for user_id in user_ids:
+        increments[user_id] = increments.get(user_id, 0) + delta
+    await db.notification_counters.bulk_write([
+        UpdateOne({"_id": user_id}, {"$inc": {"unread": inc}}, upsert=True)
+        for user_id, inc in increments.items()
+    ], ordered=False)
+    await unread_count_cache.invalidate("unread_count", list(increments))
+
+async def backfill_unread_counts():
+    # Seed the counters from existing notifications once
+    if await db.notification_counters.estimated_document_count() > 0:
+        return
+    counts = await db.notifications.aggregate([
+        {"$match": {"read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}}
+    ]).to_list(None)
+    if counts:
+        await db.notification_counters.insert_many(counts)
+        logger.info(f"Backfilled unread notification counts for {len(counts)} users")
+
+def notification_response(notif: dict) -> NotificationResponse:
+    content = notif["content"]
+    # Likes keep being merged into one notification, so the text follows the count
+    if notif["type"] == "like" and notif.get("count", 1) > 1:
+        content = f"等{notif['count']}人赞了你的视频"
+    return NotificationResponse(
         id=str(notif["_id"]),
         type=notif["type"],
         from_user_id=notif["from_user_id"],
         from_username=notif["from_username"],
-        content=notif["content"],
+        content=content,
         video_id=notif.get("video_id"),
+        count=notif.get("count", 1),
         read=notif.get("read", False),
         created_at=notif["created_at"]
-    ) for notif in notifications]
+    )
+
+@api_router.get("/notifications", response_model=List[NotificationResponse])
+async def get_notifications(current_user = Depends(get_current_user)):
+    user_id = str(current_user["_id"])
+    
+    notifications = await db.notifications.find({"user_id": user_id}).sort("created_at", -1).to_list(1000)
+    
+    return [notification_response(notif) for notif in notifications]
+
+@api_router.get("/notifications/unread_count", response_model=UnreadCountResponse)
+async def get_unread_count(current_user = Depends(get_current_user)):
+    user_id = str(current_user["_id"])
+    
+    unread = await unread_count_cache.get("unread_count", user_id)
+    if unread is None:
+        counter = await db.notification_counters.find_one({"_id": user_id})
+        unread = max(counter["unread"], 0) if counter else 0
+        await unread_count_cache.set("unread_count", user_id, unread)
+    
+    return UnreadCountResponse(unread=unread)
+
+@api_router.post("/notifications/read")
+async def mark_notifications_read(read_data: NotificationsRead, current_user = Depends(get_current_user)):
+    user_id = str(current_user["_id"])
+    
+    if read_data.ids is None and read_data.up_to is None:
+        raise HTTPException(status_code=400, detail="Provide ids or up_to")
+    
+    query = {"user_id": user_id, "read": False}
+    if read_data.ids is not None:
+        query["_id"] = {"$in": [ObjectId(i) for i in read_data.ids if ObjectId.is_valid(i)]}
+    if read_data.up_to is not None:
+        query["created_at"] = {"$lte": read_data.up_to}
+    
+    result = await db.notifications.update_many(query, {"$set": {"read": True}})
+    if result.modified_count:
+        await adjust_unread_counts([user_id], -result.modified_count)
+    
+    return {"success": True, "updated": result.modified_count}
 
 @api_router.post("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user = Depends(get_current_user)):
-    await db.notifications.update_one(
-        {"_id": ObjectId(notification_id)},
+    user_id = str(current_user["_id"])
+    
+    if not ObjectId.is_valid(notification_id):
+        raise HTTPException(status_code=404, detail="Notification not found")
+    
+    result = await db.notifications.update_one(
+        {"_id": ObjectId(notification_id), "user_id": user_id, "read": False},
         {"$set": {"read": True}}
     )
+    if result.modified_count:
+        await adjust_unread_counts([user_id], -1)
     return {"success": True}
 
 # Follow Routes
@@ -600,24 +2967,24 @@ async def follow_user(user_id: str, current_user = Depends(get_current_user)):
     if existing:
         raise HTTPException(status_code=400, detail="Already following")
     
-    # Create follow
-    await db.follows.insert_one({
-        "_id": ObjectId(),
-        "follower_id": follower_id,
-        "following_id": user_id,
-        "created_at": datetime.utcnow()
-    })
+    # Create follow; the unique index rejects a concurrent duplicate
+    try:
+        await db.follows.insert_one({
+            "_id": ObjectId(),
+            "follower_id": follower_id,
+            "following_id": user_id,
+            "created_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Already following")
     
-    # Create notification
-    await db.notifications.insert_one({
-        "_id": ObjectId(),
+    # Create notification in the background
+    notification_pipeline.submit({
         "user_id": user_id,
         "type": "follow",
         "from_user_id": follower_id,
         "from_username": current_user["username"],
-        "content": "关注了你",
-        "read": False,
-        "created_at": datetime.utcnow()
+        "content": "关注了你"
     })
     
     return {"success": True}
@@ -645,12 +3012,9 @@ async def save_search_history(keyword: str, current_user = Depends(get_current_u
         "created_at": datetime.utcnow()
     })
     
-    # Update global hot search count
-    await db.hot_searches.update_one(
-        {"keyword": keyword},
-        {"$inc": {"count": 1}, "$set": {"updated_at": datetime.utcnow()}},
-        upsert=True
-    )
+    # Hot search counts live in memory and are flushed to hot_searches in batches
+    trending_searches.record(keyword)
+    suggestion_trie.increment(keyword)
     
     return {"success": True}
 
@@ -685,64 +3049,77 @@ async def clear_search_history(current_user = Depends(get_current_user)):
     return {"success": True}
 
 @api_router.get("/search/hot", response_model=List[HotSearchResponse])
-async def get_hot_searches():
-    hot_searches = await db.hot_searches.find().sort("count", -1).limit(10).to_list(10)
-    
-    return [HotSearchResponse(
-        keyword=h["keyword"],
-        count=h["count"]
-    ) for h in hot_searches]
+async def get_hot_searches(request: Request, response: Response):
+    cached = await response_cache.get("search_hot", "top")
+    if cached is None:
+        # Ranked by time-decayed search count, so recent searches outweigh old spikes
+        body = [{"keyword": keyword, "count": max(1, round(score))}
+                for keyword, score in trending_searches.top(HOT_SEARCH_LIMIT)]
+        cached = await response_cache.set("search_hot", "top", [make_etag(body), body])
+
+    etag, body = cached
+    return etag_response(request, response, etag, body)
+
+@api_router.get("/search/suggest", response_model=List[HotSearchResponse])
+async def suggest_searches(
+    prefix: str = "",
+    limit: int = Query(SUGGESTION_LIMIT, ge=1, le=SUGGESTION_LIMIT),
+    current_user = Depends(get_current_user)
+):
+    # Served entirely from memory so clients can call it on every keystroke
+    return [HotSearchResponse(keyword=keyword, count=count)
+            for keyword, count in suggestion_trie.suggest(prefix, limit)]
+
+async def search_videos(keyword: str, user_id: str) -> List[VideoResponse]:
+    # Search videos through the in-process index, then load the hits by id
+    video_ids = video_search_index.search(keyword, SEARCH_RESULT_LIMIT)
+    video_results = await read_db.videos.find(
+        {"_id": {"$in": [ObjectId(v) for v in video_ids]}}
+    ).to_list(len(video_ids))
+    by_id = {str(video["_id"]): video for video in video_results}
+    liked_video_ids = await get_liked_video_ids(user_id, list(by_id))
+    
+    return [
+        video_response(by_id[video_id], video_id in liked_video_ids)
+        for video_id in video_ids if video_id in by_id
+    ]
+
+async def search_users(keyword: str) -> List[UserResponse]:
+    user_ids = user_search_index.search(keyword, SEARCH_RESULT_LIMIT)
+    user_results = await read_db.users.find(
+        {"_id": {"$in": [ObjectId(u) for u in user_ids]}}
+    ).to_list(len(user_ids))
+    by_id = {str(u["_id"]): u for u in user_results}
+    
+    return [UserResponse(
+        id=user_id,
+        email=by_id[user_id]["email"],
+        username=by_id[user_id]["username"],
+        bio=by_id[user_id].get("bio", ""),
+        avatar=by_id[user_id].get("avatar"),
+        created_at=by_id[user_id]["created_at"]
+    ) for user_id in user_ids if user_id in by_id]
+
+async def search_branch(name: str, coro) -> list:
+    # A slow branch returns no results rather than holding up the others
+    try:
+        return await asyncio.wait_for(coro, SEARCH_BRANCH_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning(f"Search branch {name} timed out after {SEARCH_BRANCH_TIMEOUT_SECONDS}s")
+        return []
 
 @api_router.get("/search", response_model=SearchResultResponse)
 async def search(keyword: str, category: str = "all", current_user = Depends(get_current_user)):
     user_id = str(current_user["_id"])
     
-    videos = []
-    users = []
-    
-    if category in ["all", "video"]:
-        # Search videos
-        video_results = await db.videos.find({
-            "$or": [
-                {"title": {"$regex": keyword, "$options": "i"}},
-                {"author": {"$regex": keyword, "$options": "i"}}
-            ]
-        }).limit(20).to_list(20)
-        
-        for video in video_results:
-            video_id = str(video["_id"])
-            is_liked = await db.likes.find_one({"user_id": user_id, "video_id": video_id}) is not None
-            
-            videos.append(VideoResponse(
-                id=video_id,
-                video_url=video["video_url"],
-                title=video["title"],
-                author=video["author"],
-                likes_count=video["likes_count"],
-                comments_count=video["comments_count"],
-                views=video["views"],
-                created_at=video["created_at"],
-                is_liked=is_liked
-            ))
-    
-    if category in ["all", "user"]:
-        # Search users
-        user_results = await db.users.find({
-            "$or": [
-                {"username": {"$regex": keyword, "$options": "i"}},
-                {"email": {"$regex": keyword, "$options": "i"}}
-            ]
-        }).limit(20).to_list(20)
-        
-        for u in user_results:
-            users.append(UserResponse(
-                id=str(u["_id"]),
-                email=u["email"],
-                username=u["username"],
-                bio=u.get("bio", ""),
-                avatar=u.get("avatar"),
-                created_at=u["created_at"]
-            ))
+    async def no_results():
+        return []
+    
+    # Video and user branches run concurrently
+    videos, users = await asyncio.gather(
+        search_branch("video", search_videos(keyword, user_id)) if category in ["all", "video"] else no_results(),
+        search_branch("user", search_users(keyword)) if category in ["all", "user"] else no_results()
+    )
     
     return SearchResultResponse(
         videos=videos,
@@ -750,10 +3127,132 @@ async def search(keyword: str, category: str = "all", current_user = Depends(get
         total_count=len(videos) + len(users)
     )
 
+@api_router.websocket("/ws")
+async def realtime_events(websocket: WebSocket, token: Optional[str] = None):
+    # Browsers cannot set headers on a WebSocket, so the JWT may come as ?token=
+    auth_header = websocket.headers.get("authorization", "")
+    if token is None and auth_header.lower().startswith("bearer "):
+        token = auth_header[7:]
+    try:
+        user = await authenticate_token(token or "")
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    channel = f"user:{user['_id']}"
+    queue = pubsub.subscribe(channel)
+    
+    def token_valid() -> bool:
+        # Expiry and revocation are both checked by decode_token, in memory
+        try:
+            decode_token(token)
+        except HTTPException:
+            return False
+        return True
+    
+    async def forward_events():
+        while True:
+            event = await queue.get()
+            if not token_valid():
+                return
+            await websocket.send_json(event)
+    
+    async def watch_token():
+        # Idle connections get no sends, so the token is also rechecked on a timer
+        while token_valid():
+            await asyncio.sleep(WS_AUTH_CHECK_INTERVAL_SECONDS)
+    
+    async def wait_for_disconnect():
+        # Client messages are ignored; receiving only detects the close
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+    
+    disconnect = asyncio.create_task(wait_for_disconnect())
+    tasks = [asyncio.create_task(forward_events()), asyncio.create_task(watch_token()), disconnect]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        if disconnect not in done and not token_valid():
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+    finally:
+        for task in tasks:
+            task.cancel()
+        pubsub.unsubscribe(channel, queue)
+
+@api_router.get("/metrics")
+async def get_metrics(current_user = Depends(get_current_user)):
+    return {
+        "user_cache": user_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "token_revocations": token_revocations.stats(),
+        "unread_count_cache": unread_count_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "mongo_pools": pool_metrics.stats(),
+        "change_feed": change_feed.stats(),
+        "pubsub": pubsub.stats(),
+        "notifications": notification_pipeline.stats()
+    }
+
 @api_router.get("/")
 async def root():
     return {"message": "Vyzo API v1.0"}
 
+# Media Routes
+def parse_range(header: str, size: int) -> Tuple[int, int]:
+    # Only single ranges are served: "bytes=start-end", "bytes=start-" or "bytes=-suffix"
+    unit, _, spec = header.partition("=")
+    start_text, sep, end_text = spec.strip().partition("-")
+    if unit.strip() != "bytes" or not sep or "," in spec:
+        raise ValueError(header)
+    if start_text:
+        start = int(start_text)
+        end = min(int(end_text), size - 1) if end_text else size - 1
+    else:
+        start = max(0, size - int(end_text))
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+@api_router.get("/media/{digest}")
+async def get_media(digest: str, request: Request):
+    if not MEDIA_HASH_RE.match(digest) or not media_store.exists(digest):
+        raise HTTPException(status_code=404, detail="Media not found")
+    
+    # Blobs are served without auth, message images included: the 256-bit hash
+    # is the capability, handed out only to those who can read the document.
+    # Content-addressed blobs never change, so clients may cache them forever
+    headers = {
+        "ETag": f'"{digest}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff"
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    
+    size = media_store.path(digest).stat().st_size
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if range_header:
+        try:
+            start, end = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    
+    return StreamingResponse(
+        media_store.read_range(digest, start, end),
+        status_code=status_code,
+        media_type=media_store.content_type(digest),
+        headers=headers
+    )
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -763,6 +3262,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Configure logging
@@ -772,11 +3272,98 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def run_once(name: str, task) -> bool:
+    """Run `task` in exactly one worker; the others wait until it has finished.
+
+    The lock is a lease in the `locks` collection, renewed while the task runs,
+    so a worker that dies mid-task is taken over once the lease lapses. Returns
+    False in workers that found the work already done.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    lease = timedelta(seconds=STARTUP_LOCK_LEASE_SECONDS)
+    while True:
+        now = datetime.utcnow()
+        try:
+            # Matches only a lapsed lock; a live one makes the upsert collide on _id
+            await db.locks.find_one_and_update(
+                {"_id": name, "expires_at": {"$lt": now}},
+                {"$set": {"owner": owner, "done": False, "expires_at": now + lease}},
+                upsert=True
+            )
+            break
+        except DuplicateKeyError:
+            lock = await db.locks.find_one({"_id": name})
+            if lock and lock.get("done"):
+                return False
+            await asyncio.sleep(1)
+    
+    async def renew():
+        while True:
+            await asyncio.sleep(STARTUP_LOCK_LEASE_SECONDS / 3)
+            await db.locks.update_one(
+                {"_id": name, "owner": owner}, {"$set": {"expires_at": datetime.utcnow() + lease}}
+            )
+    
+    renewal = asyncio.create_task(renew())
+    try:
+        await task()
+    except Exception:
+        await db.locks.delete_one({"_id": name, "owner": owner})
+        raise
+    finally:
+        renewal.cancel()
+    await db.locks.update_one({"_id": name, "owner": owner}, {"$set": {
+        "done": True,
+        "expires_at": datetime.utcnow() + timedelta(seconds=STARTUP_DONE_TTL_SECONDS)
+    }})
+    return True
+
+async def run_maintenance():
+    await remove_duplicate_likes()
+    await remove_duplicate_follows()
+    await ensure_indexes()
+    await report_collection_scans()
+    await initialize_videos()
+    await backfill_engagement_scores()
+    await backfill_watched_videos()
+    await backfill_conversations()
+    await backfill_conversation_usernames()
+    await backfill_unread_counts()
+    await backfill_media()
+    await backfill_author_snapshots()
+
 @app.on_event("startup")
 async def startup_event():
-    await initialize_videos()
-    logger.info("Vyzo API started successfully")
+    # Index and data maintenance is shared by every worker, so only one runs it
+    if not await run_once("startup_maintenance", run_maintenance):
+        logger.info("Startup maintenance already done by another worker")
+    # Fix the change feed's starting point first, so writes made while the
+    # in-process state below loads are replayed on top of it
+    await change_feed.open()
+    await token_revocations.load()
+    await profile_reconciler.load()
+    await build_search_indexes()
+    await trending_searches.load()
+    change_feed.start()
+    if WEB_CONCURRENCY > 1 and not (pubsub.cross_process and change_feed.source in ("stream", "poll")):
+        logger.warning(
+            f"PUBSUB_BACKEND={PUBSUB_BACKEND} with {WEB_CONCURRENCY} workers and the change feed "
+            f"{change_feed.source}: real-time events only reach WebSockets connected to the worker "
+            "that published them"
+        )
+    trending_searches.start()
+    view_buffer.start()
+    profile_reconciler.start()
+    notification_pipeline.start()
+    logger.info(f"Vyzo API worker {os.getpid()} started successfully")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Flush buffered views and notifications before the connection goes away
+    await notification_pipeline.stop()
+    await view_buffer.stop()
+    await trending_searches.stop()
+    await profile_reconciler.stop()
+    await change_feed.stop()
+    password_executor.shutdown(wait=False)
     client.close()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Vyzo API Performance Suite
+Drives the FastAPI app in-process and reports latency, throughput and
+Mongo query counts per endpoint
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "vyzo_benchmark")
+
+import server  # noqa: E402
+from bson import ObjectId  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Maximum Mongo queries per request before an endpoint is flagged as N+1
+QUERY_BUDGETS = {
+    "feed": 6,
+    "comments": 4,
+    "messages": 3,
+    "inbox": 3,
+    "search": 4,
+}
+
+SEARCH_KEYWORDS = ["dance", "cat", "travel", "food", "music", "vlog"]
+
+
+class CountingCollection:
+    """Wraps a Motor collection and counts every operation issued through it"""
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self._counter[self._collection.name] = self._counter.get(self._collection.name, 0) + 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    """Stands in for `server.db` so the handlers' queries can be counted"""
+
+    def __init__(self, database):
+        self._database = database
+        self.counter = {}
+
+    def __getattr__(self, name):
+        return self[name]
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self.counter)
+
+    def reset(self):
+        self.counter.clear()
+
+    def total(self):
+        return sum(self.counter.values())
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class VyzoBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.users = []
+        self.tokens = []
+        self.video_ids = []
+        self.results = []
+
+        if args.mongo_url:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            client = AsyncIOMotorClient(args.mongo_url)
+        else:
+            from mongomock_motor import AsyncMongoMockClient
+            client = AsyncMongoMockClient()
+        server.client = client
+        self.raw_db = client[os.environ["DB_NAME"]]
+        self.db = CountingDatabase(self.raw_db)
+        server.db = self.db
+        server.read_db = self.db
+        # Polling the in-memory stand-in for changes would add its scans to every query count
+        server.change_feed.mode = "off"
+
+    async def seed(self):
+        """Insert the configured data volumes directly, bypassing the API"""
+        args = self.args
+        now = datetime.utcnow()
+        print(f"Seeding {args.users} users, {args.videos} videos, {args.likes} likes, "
+              f"{args.comments} comments, {args.messages} messages")
+
+        for collection in ["users", "videos", "likes", "comments", "comment_likes", "messages",
+                           "conversations", "notifications", "hot_searches", "watch_history",
+                           "watched_videos"]:
+            await self.raw_db[collection].delete_many({})
+
+        self.users = [{
+            "_id": ObjectId(),
+            "email": f"bench{i}@example.com",
+            "password": "",
+            "username": f"bench_user_{i}",
+            "bio": "",
+            "avatar": None,
+            "created_at": now - timedelta(minutes=i)
+        } for i in range(args.users)]
+        await self.raw_db.users.insert_many(self.users)
+        self.tokens = [server.create_access_token({"user_id": str(u["_id"])}) for u in self.users]
+
+        videos = [{
+            "_id": ObjectId(),
+            "video_url": f"https://example.com/{i}.mp4",
+            "title": f"{self.random.choice(SEARCH_KEYWORDS)} clip {i}",
+            "author": f"bench_user_{self.random.randrange(args.users)}",
+            "likes_count": 0,
+            "comments_count": 0,
+            "views": self.random.randrange(1000),
+            "created_at": now - timedelta(seconds=i)
+        } for i in range(args.videos)]
+        self.video_ids = [str(v["_id"]) for v in videos]
+
+        likes = {}
+        for _ in range(args.likes):
+            user = self.random.choice(self.users)
+            video = self.random.choice(videos)
+            likes[(str(user["_id"]), str(video["_id"]))] = video
+        for video in likes.values():
+            video["likes_count"] += 1
+        if likes:
+            await self.raw_db.likes.insert_many([
+                {"_id": ObjectId(), "user_id": u, "video_id": v, "created_at": now} for u, v in likes
+            ])
+
+        # Comments pile up on the first video to exercise long threads
+        hot_video = videos[0]
+        comments = [{
+            "_id": ObjectId(),
+            "user_id": str(self.random.choice(self.users)["_id"]),
+            "video_id": str(hot_video["_id"]),
+            "text": f"comment {i}",
+            "image_hash": None,
+            "likes_count": 0,
+            "created_at": now - timedelta(seconds=i)
+        } for i in range(args.comments)]
+        hot_video["comments_count"] = len(comments)
+        if comments:
+            await self.raw_db.comments.insert_many(comments)
+
+        await self.raw_db.videos.insert_many(videos)
+
+        # Messages all involve the first user, the one the listing scenarios run as
+        messages = []
+        for i in range(args.messages):
+            peer = str(self.random.choice(self.users[1:] or self.users)["_id"])
+            sender, receiver = (str(self.users[0]["_id"]), peer) if i % 2 else (peer, str(self.users[0]["_id"]))
+            messages.append({
+                "_id": ObjectId(),
+                "sender_id": sender,
+                "receiver_id": receiver,
+                "text": f"message {i}",
+                "image_hash": None,
+                "read": False,
+                "created_at": now - timedelta(seconds=i)
+            })
+        if messages:
+            await self.raw_db.messages.insert_many(messages)
+
+        await self.raw_db.hot_searches.insert_many([
+            {"keyword": keyword, "count": self.random.randrange(1, 500), "updated_at": now}
+            for keyword in SEARCH_KEYWORDS
+        ])
+
+    def scenarios(self):
+        first_video = self.video_ids[0]
+        return [
+            ("feed", "GET", lambda: "/api/videos/feed"),
+            ("comments", "GET", lambda: f"/api/videos/{first_video}/comments"),
+            ("messages", "GET", lambda: "/api/messages"),
+            ("inbox", "GET", lambda: "/api/conversations"),
+            ("notifications", "GET", lambda: "/api/notifications"),
+            ("search", "GET", lambda: f"/api/search?keyword={self.random.choice(SEARCH_KEYWORDS)}"),
+            ("hot_searches", "GET", lambda: "/api/search/hot"),
+            ("view", "POST", lambda: f"/api/videos/{self.random.choice(self.video_ids)}/view"),
+        ]
+
+    async def run_scenario(self, client, name, method, path):
+        args = self.args
+        headers = {"Authorization": f"Bearer {self.tokens[0]}"}
+        latencies = []
+        errors = 0
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                url = path()
+                body = {"video_id": url.split("/")[-2], "watch_duration": 1.0} if method == "POST" else None
+                started = time.perf_counter()
+                response = await client.request(method, url, headers=headers, json=body)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+
+        # One warm-up request so cold caches don't skew the query count
+        await one()
+        latencies.clear()
+        errors = 0
+
+        self.db.reset()
+        started = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(args.requests)])
+        elapsed = time.perf_counter() - started
+
+        queries = self.db.total() / args.requests
+        budget = QUERY_BUDGETS.get(name)
+        self.results.append({
+            "endpoint": name,
+            "throughput": args.requests / elapsed,
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "queries": queries,
+            "errors": errors,
+            "over_budget": budget is not None and queries > budget,
+        })
+
+    async def run(self):
+        await self.seed()
+        await server.startup_event()
+        try:
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                for name, method, path in self.scenarios():
+                    if self.args.only and name not in self.args.only:
+                        continue
+                    await self.run_scenario(client, name, method, path)
+        finally:
+            await server.view_buffer.stop()
+
+    def print_report(self):
+        print("\n" + "=" * 78)
+        print("📊 BENCHMARK RESULTS")
+        print("=" * 78)
+        print(f"{'endpoint':<15}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+              f"{'queries':>10}{'errors':>8}")
+        for r in self.results:
+            flag = "  ❌ N+1" if r["over_budget"] else ""
+            print(f"{r['endpoint']:<15}{r['throughput']:>10.1f}{r['p50']:>10.2f}{r['p95']:>10.2f}"
+                  f"{r['p99']:>10.2f}{r['queries']:>10.1f}{r['errors']:>8}{flag}")
+        print("=" * 78)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the Vyzo API in-process")
+    parser.add_argument("--mongo-url", help="use a real mongod instead of the in-memory stand-in")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--videos", type=int, default=1000)
+    parser.add_argument("--likes", type=int, default=5000)
+    parser.add_argument("--comments", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", nargs="*", help="endpoints to run, e.g. feed comments")
+    parser.add_argument("--strict", action="store_true",
+                        help="exit non-zero when an endpoint exceeds its query budget")
+    return parser.parse_args()
+
+
+def main():
+    """Main benchmark execution"""
+    args = parse_args()
+    benchmark = VyzoBenchmark(args)
+    asyncio.run(benchmark.run())
+    benchmark.print_report()
+
+    if args.strict and any(r["over_budget"] for r in benchmark.results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -40,6 +40,8 @@ export default function CommentsModal({
   const [comments, setComments] = useState<Comment[]>([]);
   const [newComment, setNewComment] = useState('');
   const [loading, setLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [submitting, setSubmitting] = useState(false);
 
   useEffect(() => {
@@ -53,6 +55,7 @@ export default function CommentsModal({
     try {
       const response = await api.get(`/videos/${videoId}/comments`);
       setComments(response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error loading comments:', error);
     } finally {
@@ -60,6 +63,28 @@ export default function CommentsModal({
     }
   };
 
+  // Comments are paged; the next page's cursor comes back in X-Next-Cursor
+  const loadMoreComments = async () => {
+    if (!nextCursor || loadingMore || loading) {
+      return;
+    }
+    setLoadingMore(true);
+    try {
+      const response = await api.get(`/videos/${videoId}/comments`, {
+        params: { cursor: nextCursor },
+      });
+      setComments(prevComments => {
+        const seen = new Set(prevComments.map(comment => comment.id));
+        return [...prevComments, ...response.data.filter((comment: Comment) => !seen.has(comment.id))];
+      });
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error loading more comments:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSubmitComment = async () => {
     if (!newComment.trim()) return;
 
@@ -138,6 +163,11 @@ export default function CommentsModal({
               renderItem={renderComment}
               keyExtractor={(item) => item.id}
               contentContainerStyle={styles.commentsList}
+              onEndReached={loadMoreComments}
+              onEndReachedThreshold={0.5}
+              ListFooterComponent={
+                loadingMore ? <ActivityIndicator size="small" color="#FF0050" /> : null
+              }
               ListEmptyComponent={
                 <View style={styles.emptyContainer}>
                   <Text style={styles.emptyText}>No comments yet</Text>
@@ -49,9 +49,10 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
   const login = async (email: string, password: string) => {
     try {
       const response = await api.post('/auth/login', { email, password });
-      const { access_token, user: userData } = response.data;
+      const { access_token, refresh_token, user: userData } = response.data;
       
       await AsyncStorage.setItem('token', access_token);
+      await AsyncStorage.setItem('refresh_token', refresh_token);
       await AsyncStorage.setItem('user', JSON.stringify(userData));
       
       setToken(access_token);
@@ -64,9 +65,10 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
   const register = async (email: string, password: string, username: string, bio: string = '') => {
     try {
       const response = await api.post('/auth/register', { email, password, username, bio });
-      const { access_token, user: userData } = response.data;
+      const { access_token, refresh_token, user: userData } = response.data;
       
       await AsyncStorage.setItem('token', access_token);
+      await AsyncStorage.setItem('refresh_token', refresh_token);
       await AsyncStorage.setItem('user', JSON.stringify(userData));
       
       setToken(access_token);
@@ -77,7 +79,14 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
   };
 
   const logout = async () => {
+    try {
+      const refreshToken = await AsyncStorage.getItem('refresh_token');
+      await api.post('/auth/logout', { refresh_token: refreshToken });
+    } catch (error) {
+      console.error('Error revoking tokens:', error);
+    }
     await AsyncStorage.removeItem('token');
+    await AsyncStorage.removeItem('refresh_token');
     await AsyncStorage.removeItem('user');
     setToken(null);
     setUser(null);
@@ -26,10 +26,27 @@ interface VideoData {
   is_liked: boolean;
 }
 
+// A page can come back short (even empty) when the user has watched most of
+// what was scanned; follow the cursor a few times before showing it
+const fetchFeedPage = async (cursor: string | null) => {
+  let videos: VideoData[] = [];
+  for (let attempt = 0; attempt < 5; attempt++) {
+    const response = await api.get('/videos/feed', { params: cursor ? { cursor } : {} });
+    videos = [...videos, ...response.data];
+    cursor = response.headers['x-next-cursor'] || null;
+    if (videos.length > 0 || !cursor) {
+      break;
+    }
+  }
+  return { videos, cursor };
+};
+
 export default function FeedScreen() {
   const [videos, setVideos] = useState<VideoData[]>([]);
   const [activeVideoIndex, setActiveVideoIndex] = useState(0);
   const [loading, setLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [commentsModalVisible, setCommentsModalVisible] = useState(false);
   const [selectedVideoId, setSelectedVideoId] = useState<string | null>(null);
   const flatListRef = useRef<FlatList>(null);
@@ -41,8 +58,9 @@ export default function FeedScreen() {
   const loadVideos = async () => {
     setLoading(true);
     try {
-      const response = await api.get('/videos/feed');
-      setVideos(response.data);
+      const page = await fetchFeedPage(null);
+      setVideos(page.videos);
+      setNextCursor(page.cursor);
     } catch (error: any) {
       Alert.alert('Error', 'Failed to load videos');
       console.error('Error loading videos:', error);
@@ -51,6 +69,26 @@ export default function FeedScreen() {
     }
   };
 
+  // The feed is paged; the next page's cursor comes back in X-Next-Cursor
+  const loadMoreVideos = async () => {
+    if (!nextCursor || loadingMore || loading) {
+      return;
+    }
+    setLoadingMore(true);
+    try {
+      const page = await fetchFeedPage(nextCursor);
+      setVideos(prevVideos => {
+        const seen = new Set(prevVideos.map(video => video.id));
+        return [...prevVideos, ...page.videos.filter(video => !seen.has(video.id))];
+      });
+      setNextCursor(page.cursor);
+    } catch (error: any) {
+      console.error('Error loading more videos:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const onViewableItemsChanged = useRef(
     ({ viewableItems }: { viewableItems: ViewToken[] }) => {
       if (viewableItems.length > 0) {
@@ -117,6 +155,8 @@ export default function FeedScreen() {
         viewabilityConfig={viewabilityConfig}
         snapToInterval={SCREEN_HEIGHT}
         decelerationRate="fast"
+        onEndReached={loadMoreVideos}
+        onEndReachedThreshold={2}
         refreshControl={
           <RefreshControl
             refreshing={loading}
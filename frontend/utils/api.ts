@@ -25,4 +25,44 @@ api.interceptors.request.use(
   }
 );
 
+// Access tokens are short-lived: on a 401, trade the refresh token for a new
+// pair once and replay the request. Concurrent 401s share one refresh.
+let refreshing: Promise<string | null> | null = null;
+
+const refreshAccessToken = async (): Promise<string | null> => {
+  const refreshToken = await AsyncStorage.getItem('refresh_token');
+  if (!refreshToken) {
+    return null;
+  }
+  try {
+    const response = await axios.post(`${BACKEND_URL}/api/auth/refresh`, { refresh_token: refreshToken });
+    const { access_token, refresh_token } = response.data;
+    await AsyncStorage.setItem('token', access_token);
+    await AsyncStorage.setItem('refresh_token', refresh_token);
+    return access_token;
+  } catch (error) {
+    await AsyncStorage.multiRemove(['token', 'refresh_token', 'user']);
+    return null;
+  }
+};
+
+api.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    if (error.response?.status === 401 && original && !original._retry && !original.url?.startsWith('/auth/')) {
+      original._retry = true;
+      refreshing = refreshing || refreshAccessToken().finally(() => {
+        refreshing = null;
+      });
+      const token = await refreshing;
+      if (token) {
+        original.headers.Authorization = `Bearer ${token}`;
+        return api(original);
+      }
+    }
+    return Promise.reject(error);
+  }
+);
+
 export default api;
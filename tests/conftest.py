@@ -0,0 +1,8 @@
+import os
+import sys
+
+# server.py reads its Mongo settings at import time; the client connects lazily,
+# so these tests never need a running server
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "vyzo_test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
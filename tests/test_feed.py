@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi import Response
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+@pytest.fixture
+def feed_db(monkeypatch):
+    db = AsyncMongoMockClient()["vyzo_test"]
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "read_db", db)
+    monkeypatch.setattr(server, "response_cache", server.SharedCache(server.InMemorySharedState(100), 60))
+    return db
+
+
+def walk_feed(user_id: str, limit: int):
+    """Follow X-Next-Cursor until it is absent, returning the ids served and the request count."""
+    async def walk():
+        served, cursor, requests = [], None, 0
+        while True:
+            response = Response()
+            page = await server.get_video_feed(response, cursor=cursor, limit=limit, current_user={"_id": ObjectId(user_id)})
+            requests += 1
+            served.extend(video.id for video in page)
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return served, requests
+            assert requests < 100, "feed did not terminate"
+    return asyncio.run(walk())
+
+
+def seed(db, count: int, watched_by: str = None, watched: int = 0):
+    async def insert():
+        videos = [{
+            "_id": ObjectId(),
+            "video_url": f"https://example.com/{i}.mp4",
+            "title": f"video {i}",
+            "author": "someone",
+            "likes_count": 0,
+            "comments_count": 0,
+            "views": 0,
+            "engagement_score": count - i,
+            "created_at": datetime(2024, 1, 1),
+        } for i in range(count)]
+        await db.videos.insert_many(videos)
+        if watched:
+            await db.watched_videos.insert_many([
+                {"user_id": watched_by, "video_id": str(video["_id"]), "watch_count": 1} for video in videos[:watched]
+            ])
+        return [str(video["_id"]) for video in videos]
+    return asyncio.run(insert())
+
+
+def test_feed_walks_fully_watched_catalog_to_the_end(feed_db, monkeypatch):
+    monkeypatch.setattr(server, "FEED_MAX_SCAN_BATCHES", 2)
+    user_id = str(ObjectId())
+    ids = seed(feed_db, 20, watched_by=user_id, watched=20)
+    
+    served, _ = walk_feed(user_id, limit=5)
+    assert served == ids
+
+
+def test_feed_serves_unwatched_first_then_watched(feed_db, monkeypatch):
+    monkeypatch.setattr(server, "FEED_MAX_SCAN_BATCHES", 2)
+    user_id = str(ObjectId())
+    ids = seed(feed_db, 60, watched_by=user_id, watched=45)
+    
+    served, requests = walk_feed(user_id, limit=5)
+    assert served == ids[45:] + ids[:45]
+    assert requests > 1
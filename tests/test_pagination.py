@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from server import after_cursor, decode_cursor, encode_cursor, parse_range
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    last_id = ObjectId()
+    cursor = encode_cursor(created_at.isoformat(), last_id)
+    assert decode_cursor(cursor, datetime.fromisoformat, ObjectId) == (created_at, last_id)
+    assert decode_cursor(encode_cursor(1.5, "a_b"), float, str) == (1.5, "a_b")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    encode_cursor("2024-05-01T12:30:15"),
+    encode_cursor("2024-05-01T12:30:15", ObjectId(), "extra"),
+    encode_cursor("yesterday", ObjectId()),
+    encode_cursor("2024-05-01T12:30:15", "not-an-id"),
+])
+def test_decode_cursor_rejects_bad_cursors(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, datetime.fromisoformat, ObjectId)
+    assert error.value.status_code == 400
+
+
+def test_after_cursor_pages_through_ties_without_gaps():
+    collection = mongomock.MongoClient().db.items
+    start = datetime(2024, 1, 1)
+    # Pairs of items share a timestamp, so the _id tie-breaker matters
+    collection.insert_many([
+        {"_id": ObjectId(), "created_at": start + timedelta(seconds=i // 2)} for i in range(7)
+    ])
+    expected = [doc["_id"] for doc in collection.find().sort([("created_at", -1), ("_id", -1)])]
+    
+    seen, query = [], {}
+    while True:
+        page = list(collection.find(query).sort([("created_at", -1), ("_id", -1)]).limit(2))
+        if not page:
+            break
+        seen.extend(doc["_id"] for doc in page)
+        query = after_cursor("created_at", page[-1]["created_at"], page[-1]["_id"])
+    assert seen == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    (" bytes = 5-5", (5, 5)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-99",
+    "bytes=0-1,5-9",
+    "bytes=100",
+    "bytes=50-10",
+    "bytes=1000-",
+    "bytes=abc-",
+])
+def test_parse_range_rejects_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
@@ -0,0 +1,166 @@
+import time
+
+import pytest
+
+from server import SearchIndex, SuggestionTrie, TrendingSearches
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex({"title": 2, "author": 1})
+    index.add("1", {"title": "Big Buck Bunny", "author": "blender"})
+    index.add("2", {"title": "Elephants Dream", "author": "blender"})
+    index.add("3", {"title": "Tears of Steel", "author": "mango"})
+    return index
+
+
+def test_one_character_query_matches_token_prefixes(index):
+    assert sorted(index.search("b", 10)) == ["1", "2"]
+    assert index.search("d", 10) == ["2"]
+    # Single characters only match at the start of a token
+    assert index.search("u", 10) == []
+
+
+def test_two_character_query_matches_substrings(index):
+    assert index.search("ck", 10) == ["1"]
+    assert index.search("ea", 10) == ["3", "2"]
+
+
+def test_longer_query_matches_substrings(index):
+    assert index.search("unn", 10) == ["1"]
+    assert index.search("dream", 10) == ["2"]
+    assert index.search("steal", 10) == []
+
+
+def test_query_is_normalized(index):
+    assert index.search("ＢＵＮＮＹ", 10) == ["1"]
+    assert index.search("  Tears  ", 10) == ["3"]
+
+
+def test_remove_drops_document_and_postings(index):
+    index.remove("1")
+    assert index.search("bunny", 10) == []
+    assert index.search("b", 10) == ["2"]
+    assert len(index) == 2
+    
+    for doc_id in ["2", "3"]:
+        index.remove(doc_id)
+    assert len(index) == 0
+    assert index._grams == {}
+    assert index._tokens == {}
+    assert index._sorted_tokens == []
+
+
+def test_add_replaces_existing_document(index):
+    index.add("1", {"title": "Sintel", "author": "blender"})
+    assert index.search("bunny", 10) == []
+    assert index.search("sintel", 10) == ["1"]
+
+
+def test_ranking_prefers_closer_matches():
+    index = SearchIndex({"title": 2, "author": 1})
+    index.add("1", {"title": "bobcat", "author": ""})
+    index.add("2", {"title": "catalog", "author": ""})
+    index.add("3", {"title": "cat video", "author": ""})
+    index.add("4", {"title": "cat", "author": ""})
+    # whole field > whole token > token prefix > substring
+    assert index.search("cat", 10) == ["4", "3", "2", "1"]
+    assert index.search("cat", 2) == ["4", "3"]
+
+
+def test_ranking_weights_fields_and_breaks_ties_by_newest():
+    index = SearchIndex({"title": 2, "author": 1})
+    index.add("1", {"title": "other", "author": "mango"})
+    index.add("2", {"title": "mango", "author": "someone"})
+    index.add("3", {"title": "other", "author": "mango"})
+    assert index.search("mango", 10) == ["2", "3", "1"]
+
+
+def test_suggestions_rank_by_weight_then_length():
+    trie = SuggestionTrie(k=3)
+    trie.set_weight("Cat", 5)
+    trie.set_weight("caterpillar", 5)
+    trie.set_weight("catalog", 1)
+    trie.add("car")
+    assert trie.suggest("ca", 10) == [("Cat", 5), ("caterpillar", 5), ("catalog", 1)]
+    assert trie.suggest("cate", 10) == [("caterpillar", 5)]
+    assert trie.suggest("dog", 10) == []
+
+
+def test_suggestion_weight_going_up_promotes_term():
+    trie = SuggestionTrie(k=2)
+    trie.set_weight("cat", 5)
+    trie.set_weight("catalog", 3)
+    trie.set_weight("car", 1)
+    assert trie.suggest("c", 10) == [("cat", 5), ("catalog", 3)]
+    
+    trie.set_weight("car", 10)
+    assert trie.suggest("c", 10) == [("car", 10), ("cat", 5)]
+    trie.increment("catalog")
+    trie.increment("catalog")
+    trie.increment("catalog")
+    assert trie.suggest("ca", 10) == [("car", 10), ("catalog", 6)]
+
+
+def test_suggestion_weight_going_down_restores_next_best():
+    trie = SuggestionTrie(k=2)
+    trie.set_weight("cat", 5)
+    trie.set_weight("catalog", 3)
+    trie.set_weight("car", 1)
+    
+    trie.set_weight("cat", 0)
+    assert trie.suggest("c", 10) == [("catalog", 3), ("car", 1)]
+    assert trie.suggest("cat", 10) == [("catalog", 3), ("cat", 0)]
+
+
+def test_removed_name_leaves_suggestions():
+    trie = SuggestionTrie(k=2)
+    trie.add("catherine")
+    trie.add("cathy")
+    trie.set_weight("cat", 1)
+    
+    trie.remove("Catherine")
+    assert trie.suggest("cath", 10) == [("cathy", 0)]
+    assert trie.suggest("c", 10) == [("cat", 1), ("cathy", 0)]
+    trie.remove("cathy")
+    assert trie.suggest("cath", 10) == []
+    assert trie._root.children["c"].children["a"].children["t"].children == {}
+    assert len(trie) == 1
+
+
+def test_removed_name_that_was_searched_stays_as_keyword():
+    trie = SuggestionTrie(k=2)
+    trie.add("cathy")
+    trie.increment("cathy")
+    trie.remove("cathy")
+    assert trie.suggest("cath", 10) == [("cathy", 1)]
+
+
+def test_keywords_are_capped_but_names_are_kept():
+    trie = SuggestionTrie(k=3, max_keywords=2)
+    trie.add("alpha")
+    for weight, keyword in enumerate(["a1", "a2", "a3", "a4", "a5"], start=1):
+        trie.set_weight(keyword, weight)
+    # Pruning keeps the top `max_keywords` once the keywords reach twice that
+    assert trie.suggest("a", 10) == [("a5", 5), ("a4", 4), ("alpha", 0)]
+    assert len(trie) == 3
+
+
+def test_trending_apply_decays_shared_score():
+    trending = TrendingSearches(half_life=60, max_keywords=10, interval=1)
+    trending.apply("cats", 8, time.time() - 120)
+    assert trending.current("cats") == pytest.approx(2, rel=1e-3)
+    
+    # A newer shared score replaces the old one rather than adding to it
+    trending.apply("cats", 4, time.time() - 60)
+    assert trending.current("cats") == pytest.approx(2, rel=1e-3)
+
+
+def test_trending_apply_keeps_unflushed_searches():
+    trending = TrendingSearches(half_life=60, max_keywords=10, interval=1)
+    trending.record("cats")
+    trending.record("cats")
+    trending.apply("cats", 8, time.time() - 120)
+    assert trending.unflushed("cats") == 2
+    assert trending.current("cats") == pytest.approx(4, rel=1e-3)
+    assert trending.top(1)[0][0] == "cats"